@@ -0,0 +1,91 @@
+"""
+   Adaptive Monte Carlo simulation of the positioning error
+
+   adaptive_errors samples every point in rounds of trials and stops sampling a point as soon as the confidence
+   interval of its mean error is small enough, so points with a flat, small error (inside the beacon triangle)
+   need few trials. adaptive_grid starts with a coarse grid and only subdivides the cells in which the error
+   changes sharply (near beacon baselines and outside the triangle).
+"""
+
+import itertools
+from statistics import NormalDist
+
+import numpy as np
+from experiment import Experiment
+
+
+def adaptive_errors(beacons, points, noise_level, variant=3, noise=None, rng=None, batch=10, max_trials=200,
+                    rel_tol=0.1, abs_tol=0.0, confidence=0.95):
+    """adaptive_errors(beacons,points,noise_level,variant,noise,rng,batch,max_trials,rel_tol,abs_tol,confidence)
+       simulates the (P,d) points as experiment.Experiment, in rounds of batch trials for all points that did
+       not converge yet. A point converges when the half width of the confidence interval of its mean error is at
+       most max(rel_tol * mean, abs_tol), or when max_trials trials are done.
+       Returns the mean error (nan when no solution was found), the half width of the confidence interval and the
+       number of trials per point."""
+    points = np.asarray(points, dtype=float)
+    rng = np.random.default_rng(rng)
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+
+    n = len(points)
+    total, total_sq = np.zeros(n), np.zeros(n)
+    found, trials = np.zeros(n, dtype=int), np.zeros(n, dtype=int)
+    mean, half_width = np.full(n, np.nan), np.full(n, np.inf)
+    active = np.arange(n)
+
+    while active.size:
+        result = Experiment(beacons, points[active], [noise_level], batch, variant, noise=noise).run(rng=rng)
+        errors = result.errors[0]
+        total[active] += np.nansum(errors, axis=1)
+        total_sq[active] += np.nansum(errors ** 2, axis=1)
+        found[active] += result.found[0]
+        trials[active] += batch
+
+        k = found[active]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean[active] = total[active] / k
+            variance = (total_sq[active] - k * mean[active] ** 2) / (k - 1)
+            half_width[active] = z * np.sqrt(np.maximum(variance, 0) / k)
+        done = (half_width[active] <= np.maximum(rel_tol * mean[active], abs_tol)) | (trials[active] >= max_trials)
+        active = active[~done]
+
+    return mean, half_width, trials
+
+
+def adaptive_grid(beacons, lower, upper, noise_level, cells=8, max_depth=3, threshold=0.5, variant=3, noise=None,
+                  rng=None, **sampling):
+    """adaptive_grid(beacons,lower,upper,noise_level,cells,max_depth,threshold,variant,noise,rng,**sampling)
+       estimates the mean error on the box between the corners lower and upper (2D or 3D). The box is divided in
+       cells x cells (x cells) cells, a cell is split in 2^d cells when the mean errors in its corners differ more
+       than threshold times their average (or a corner has no solution), up to max_depth times.
+       The points are simulated with adaptive_errors, sampling is passed on (batch, max_trials, rel_tol, ...).
+       Returns the (M,d) array with all simulated points, their mean error and number of trials."""
+    lower, upper = np.asarray(lower, dtype=float), np.asarray(upper, dtype=float)
+    dim = len(lower)
+    rng = np.random.default_rng(rng)
+    offsets = np.array(list(itertools.product((0, 1), repeat=dim)), dtype=float)  # corners of a unit cell
+
+    size = (upper - lower) / cells
+    cell_lower = lower + size * np.array(list(itertools.product(range(cells), repeat=dim)), dtype=float)
+    known = {}  # point (rounded) -> (mean, trials)
+
+    for depth in range(max_depth + 1):
+        corners = cell_lower[:, None, :] + offsets * size  # (cells, 2^d, d)
+        keys = [tuple(p) for p in np.round(corners.reshape(-1, dim), 9)]
+        new = sorted(set(keys) - known.keys())
+        if new:
+            mean, _, trials = adaptive_errors(beacons, np.array(new), noise_level, variant, noise, rng, **sampling)
+            known.update(zip(new, zip(mean, trials)))
+        if depth == max_depth:
+            break
+
+        corner_mean = np.array([known[key][0] for key in keys]).reshape(len(cell_lower), len(offsets))
+        spread = np.max(corner_mean, axis=1) - np.min(corner_mean, axis=1)
+        split = np.isnan(spread) | (spread > threshold * np.mean(corner_mean, axis=1))
+        if not np.any(split):
+            break
+        size = size / 2
+        cell_lower = (cell_lower[split][:, None, :] + offsets * size).reshape(-1, dim)
+
+    points = np.array(list(known.keys()))
+    mean, trials = (np.array(values) for values in zip(*known.values()))
+    return points, mean, trials
@@ -0,0 +1,252 @@
+"""
+   Benchmarks of the solvers and the sweep pipeline
+
+   python benchmark.py run [--quick] [--output Benchmarks/benchmark.json] [--only TEXT]
+   python benchmark.py compare baseline.json Benchmarks/benchmark.json [--threshold 0.2]
+
+   run times the single point functions (one call), the batch solvers and their circle/sphere intersection and
+   geometry helpers for 10^3 .. 10^6 fixes in 2D and 3D, for several numbers of beacons and noise levels, and an
+   end-to-end sweep. Every benchmark is repeated and the best
+   time is kept (the least disturbed run). compare prints the ratio current / baseline per benchmark and exits
+   with status 1 when a benchmark is more than threshold (relative) slower than the baseline.
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+import numpy as np
+import trilaterate2d as tr2d
+import trilaterate3d as tr3d
+from experiment import point_ranges
+from geometry import *
+from multilaterate import multilaterate
+from noise_models import Uniform
+from ransac import ransac
+from refine import refine
+from sweep import sweep
+
+LAYOUT_2D = np.array([[15., 15.], [30., 35.], [45., 15.]])  # the layout of main.py
+LAYOUT_3D = np.array([[15., 15., 0.], [30., 35., 1.], [45., 15., 2.], [30., 20., 10.]])
+SIZES = (10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6)
+QUICK_SIZES = (10 ** 3, 10 ** 4)
+NOISE_LEVELS = (0.0, 0.01, 0.1)
+OUTPUT = os.path.join('Benchmarks', 'benchmark.json')  # Benchmarks/ is ignored by git
+
+
+def best_time(function, repeat=5, min_time=0.1):
+    """best_time(function,repeat,min_time) returns the best time of one call of function (in seconds), of repeat
+       rounds in which function is called as many times as needed to run at least min_time."""
+    start = time.perf_counter()
+    function()
+    number = max(1, int(min_time / max(time.perf_counter() - start, 1e-9)))
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        times.append((time.perf_counter() - start) / number)
+    return min(times)
+
+
+def workload(beacons, size, noise_level, seed=0):
+    """workload(beacons,size,noise_level,seed) returns size random points around the beacons and their noisy
+       ranges (uniform noise as in main.py)."""
+    rng = np.random.default_rng(seed)
+    points = rng.uniform(beacons.min(axis=0) - 10, beacons.max(axis=0) + 10, (size, beacons.shape[1]))
+    return points, Uniform().apply(point_ranges(beacons, points), rng, noise_level)
+
+
+def beacon_layout(n, dim, seed=0):
+    """beacon_layout(n,dim,seed) returns n random beacons in a 60 x 40 (x 10) room."""
+    return np.random.default_rng(seed).uniform(0, 1, (n, dim)) * np.array([60., 40., 10.][:dim])
+
+
+def single_benchmarks():
+    """single_benchmarks() returns (name, params, fixes, setup) for the functions that solve one point, with
+       exact ranges of one point inside the beacons (so variant 1 finds a solution). setup() returns the function
+       that is timed."""
+    c1, c2, c3 = LAYOUT_2D
+    r1, r2, r3 = point_ranges(LAYOUT_2D, np.array([[30., 22.]]))[0]
+    s1, s2, s3, s4 = LAYOUT_3D
+    q1, q2, q3, q4 = point_ranges(LAYOUT_3D, np.array([[30., 22., 4.]]))[0]
+    solver2d, solver3d = tr2d.Trilaterator2D(LAYOUT_2D, 3), tr3d.Trilaterator3D(LAYOUT_3D)
+    sols = tr2d.circle_intersect(c1, c2, r1, r2), tr2d.circle_intersect(c1, c3, r1, r3), \
+        tr2d.circle_intersect(c2, c3, r2, r3)
+
+    benchmarks = [
+        ('geometry.distance', {}, lambda: distance(c1, c2)),
+        ('geometry.normalized', {}, lambda: normalized(c2 - c1)),
+        ('geometry.projection_rejection_reflection', {}, lambda: projection_rejection_reflection(c2 - c1, c3 - c1)),
+        ('geometry.is_collinear', {}, lambda: is_collinear(c1, c2, c3)),
+        ('geometry.is_coplanar', {}, lambda: is_coplanar(s1, s2, s3, s4)),
+        ('geometry.nearest_points', {}, lambda: nearest_points(*sols)),
+        ('trilaterate2d.circle_intersect', {}, lambda: tr2d.circle_intersect(c1, c2, r1, r2)),
+        ('trilaterate2d.trilaterate_lstsq', {}, lambda: tr2d.trilaterate_lstsq(LAYOUT_2D.T, np.array([r1, r2, r3]))),
+        ('trilaterate2d.Trilaterator2D.solve', {'variant': 3}, lambda: solver2d.solve(r1, r2, r3)),
+        ('trilaterate3d.sphere_intersections', {}, lambda: tr3d.sphere_intersections(s1, s2, s3, q1, q2, q3)),
+        ('trilaterate3d.trilaterate', {}, lambda: tr3d.trilaterate(s1, s2, s3, s4, q1, q2, q3, q4)),
+        ('trilaterate3d.Trilaterator3D.solve', {}, lambda: solver3d.solve(q1, q2, q3, q4))]
+    benchmarks += [('trilaterate2d.trilaterate', {'variant': v},
+                    lambda v=v: tr2d.trilaterate(c1, c2, c3, r1, r2, r3, v)) for v in (1, 2, 3)]
+    return [(name, params, 1, lambda function=function: function) for name, params, function in benchmarks]
+
+
+def bulk_benchmarks(sizes):
+    """bulk_benchmarks(sizes) returns (name, params, fixes, setup) for the batch solvers, for every number of
+       fixes in sizes and every noise level. The slower solvers (refine, ransac) skip the largest size.
+       setup() draws the workload and returns the function that is timed, so only the ranges of the benchmark
+       that runs are in memory."""
+
+    def setup(solver, beacons, size, noise_level, *args):
+        _, ranges = workload(beacons, size, noise_level)
+        return lambda: solver(beacons, ranges, *args)
+
+    def setup_vectors(function, size, dim, count):
+        vectors = np.random.default_rng(0).uniform(-10, 10, (count, size, dim))
+        return lambda: function(*vectors)
+
+    def circle_pair(beacons, ranges, project):
+        return tr2d.circle_intersect_batch(beacons[0], beacons[1], ranges[:, 0], ranges[:, 1], project)
+
+    def sphere_triple(beacons, ranges, project):
+        return tr3d.sphere_intersections_batch(*beacons[:3], ranges[:, 0], ranges[:, 1], ranges[:, 2], project)
+
+    def pairs(p1, p2, p3, p4, p5, p6):
+        return nearest_points_batch((p1, p2), (p3, p4), (p5, p6))
+
+    helpers = [('geometry.distance_batch', distance_batch, 3, 2),
+               ('geometry.normalized_batch', normalized_batch, 3, 1),
+               ('geometry.projection_rejection_reflection_batch', projection_rejection_reflection_batch, 3, 2),
+               ('geometry.is_collinear_batch', is_collinear_batch, 2, 3),
+               ('geometry.is_coplanar_batch', is_coplanar_batch, 3, 4),
+               ('geometry.nearest_points_batch', pairs, 2, 6)]
+
+    benchmarks = []
+    for size in sizes:
+        # the hot paths of the batch solvers
+        for name, function, dim, count in helpers:
+            benchmarks.append((name, {'fixes': size, 'dim': dim}, size,
+                               lambda f=function, s=size, d=dim, c=count: setup_vectors(f, s, d, c)))
+        for project in (False, True):
+            params = {'fixes': size, 'noise': 0.1, 'project': project}
+            benchmarks.append(('trilaterate2d.circle_intersect_batch', params, size,
+                               lambda s=size, p=project: setup(circle_pair, LAYOUT_2D, s, 0.1, p)))
+            benchmarks.append(('trilaterate3d.sphere_intersections_batch', params, size,
+                               lambda s=size, p=project: setup(sphere_triple, LAYOUT_3D, s, 0.1, p)))
+
+        for noise_level in NOISE_LEVELS:
+            params = {'fixes': size, 'noise': noise_level}
+            for v in (1, 2, 3):
+                benchmarks.append(('trilaterate2d.trilaterate_batch', dict(params, variant=v, beacons=3), size,
+                                   lambda s=size, nl=noise_level, v=v:
+                                   setup(tr2d.trilaterate_batch, LAYOUT_2D, s, nl, v)))
+            benchmarks.append(('trilaterate3d.trilaterate_batch', dict(params, beacons=4), size,
+                               lambda s=size, nl=noise_level: setup(tr3d.trilaterate_batch, LAYOUT_3D, s, nl)))
+
+        # any number of beacons, noise 0.01
+        for dim in (2, 3):
+            for n in (dim + 1, 8, 16):
+                beacons = beacon_layout(n, dim)
+                params = {'fixes': size, 'noise': 0.01, 'dim': dim, 'beacons': n}
+                benchmarks.append(('multilaterate.multilaterate', params, size,
+                                   lambda b=beacons, s=size: setup(multilaterate, b, s, 0.01)))
+                if size < 10 ** 6:
+                    benchmarks.append(('refine.refine', params, size,
+                                       lambda b=beacons, s=size: setup(refine, b, s, 0.01)))
+                if size < 10 ** 6 and n <= 8:
+                    benchmarks.append(('ransac.ransac', params, size,
+                                       lambda b=beacons, s=size: setup(ransac, b, s, 0.01, 0.05)))
+    return benchmarks
+
+
+def sweep_benchmarks(quick=False):
+    """sweep_benchmarks(quick) returns (name, params, fixes, setup) for an end-to-end sweep over two layouts and
+       the noise levels of main.py, in this process and in a process pool."""
+    x, y = np.meshgrid(np.linspace(0, 60, 60), np.linspace(0, 40, 40), indexing='ij')
+    points = np.stack((x.ravel(), y.ravel()), axis=-1)
+    layouts = [LAYOUT_2D, LAYOUT_2D + [0., 5.]]
+    levels = np.linspace(0.01, 0.1, 2 if quick else 10)
+    fixes = len(layouts) * len(levels) * len(points) * 20
+    return [('sweep.sweep', {'workers': workers, 'levels': len(levels)}, fixes,
+             lambda workers=workers: lambda: sweep(layouts, points, levels, 20, 3, seed=1, workers=workers))
+            for workers in (0, None)]
+
+
+def run(quick=False, only=None, output=OUTPUT):
+    """run(quick,only,output) runs all benchmarks (with only, those of which the name contains only) and writes
+       the results to the JSON file output. quick uses 10^3 and 10^4 fixes and fewer sweep levels.
+       The workload of a benchmark is only built when it runs."""
+    benchmarks = single_benchmarks() + bulk_benchmarks(QUICK_SIZES if quick else SIZES) + sweep_benchmarks(quick)
+    results = []
+    for name, params, fixes, setup in benchmarks:
+        if only and only not in name:
+            continue
+        seconds = best_time(setup(), repeat=3 if fixes > 1 else 5)
+        results.append({'name': name, 'params': params, 'seconds': seconds, 'per_fix': seconds / fixes})
+        print('{:46s} {:62s} {:10.3e} s {:10.3e} s/fix'.format(name, json.dumps(params), seconds, seconds / fixes))
+
+    report = {'python': platform.python_version(), 'numpy': np.__version__, 'machine': platform.machine(),
+              'platform': platform.platform(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'quick': quick,
+              'results': results}
+    if os.path.dirname(output):
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=1)
+    return report
+
+
+def key(result):
+    """key(result) returns the name and parameters of a benchmark result as a string."""
+    return result['name'] + ' ' + json.dumps(result['params'], sort_keys=True)
+
+
+def compare(baseline, current, threshold=0.2):
+    """compare(baseline,current,threshold) prints the ratio current / baseline of the benchmarks in both JSON files
+       and returns the list of benchmarks that are more than threshold slower."""
+    with open(baseline) as f:
+        old = {key(result): result['seconds'] for result in json.load(f)['results']}
+    with open(current) as f:
+        new = {key(result): result['seconds'] for result in json.load(f)['results']}
+
+    regressions = []
+    for name in sorted(old.keys() & new.keys()):
+        ratio = new[name] / old[name]
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = 'REGRESSION'
+            regressions.append(name)
+        elif ratio < 1 - threshold:
+            flag = 'faster'
+        print('{:100s} {:8.2f} {}'.format(name, ratio, flag))
+    for name in sorted(old.keys() - new.keys()):
+        print('{:100s} {:>8s}'.format(name, 'missing'))
+    print('{} benchmarks compared, {} regressions'.format(len(old.keys() & new.keys()), len(regressions)))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks of the trilateration solvers.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    run_parser = commands.add_parser('run', help='run the benchmarks')
+    run_parser.add_argument('--quick', action='store_true', help='only 10^3 and 10^4 fixes')
+    run_parser.add_argument('--only', help='only the benchmarks of which the name contains this text')
+    run_parser.add_argument('--output', default=OUTPUT, help='JSON file for the results')
+    compare_parser = commands.add_parser('compare', help='compare results with a baseline')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=0.2,
+                                help='relative slow down that counts as regression')
+    args = parser.parse_args(argv)
+
+    if args.command == 'run':
+        run(args.quick, args.only, args.output)
+    else:
+        return 1 if compare(args.baseline, args.current, args.threshold) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,128 @@
+"""
+   Monte Carlo experiment engine for the trilateration solvers
+
+   An Experiment describes one simulation: beacon layout, grid points, noise levels, number of trials per point,
+   solver variant and seed. All noisy ranges are generated at once as a (levels, points, trials, beacons) array
+   and solved with the batch solvers, the result holds the error distances and statistics as arrays.
+"""
+
+import warnings
+
+import numpy as np
+import trilaterate2d as tr2d
+import trilaterate3d as tr3d
+from geometry import STATUS_NOT_CONVERGED, STATUS_OK, STATUS_PROJECTED
+from multilaterate import multilaterate
+from noise_models import Uniform
+from refine import refine
+
+
+def solve(beacons, ranges, variant=3, project=False):
+    """solve(beacons,ranges,variant,project) solves all rows of the (N,n) array ranges for the (n,d) array beacons.
+       variant 1, 2, 3 uses trilaterate2d.trilaterate_batch (3 beacons in 2D, variant 3 is the default as in main.py)
+       or trilaterate3d.trilaterate_batch (4 beacons in 3D, the variant is not used), 'lstsq' uses multilaterate and
+       'refine' the Levenberg-Marquardt solver, both for any number of beacons (rows for which refine does not
+       converge get STATUS_NOT_CONVERGED and nan). project is passed on to the closed form solvers, near misses
+       then give an estimate with STATUS_PROJECTED.
+       Returns an (N,d) array with positions and an (N,) array with status codes."""
+    beacons = np.asarray(beacons, dtype=float)
+    ranges = np.atleast_2d(ranges)
+    if variant == 'lstsq':
+        return multilaterate(beacons, ranges), np.full(len(ranges), STATUS_OK, dtype=np.int8)
+    if variant == 'refine':
+        position, _, _, converged = refine(beacons, ranges)
+        position[~converged] = np.nan
+        return position, np.where(converged, STATUS_OK, STATUS_NOT_CONVERGED).astype(np.int8)
+    if beacons.shape == (3, 2):
+        return tr2d.trilaterate_batch(beacons, ranges, variant, project)
+    if beacons.shape == (4, 3):
+        return tr3d.trilaterate_batch(beacons, ranges, project)
+    raise ValueError('Closed form solvers need 3 beacons in 2D or 4 beacons in 3D, use variant lstsq or refine.')
+
+
+def point_ranges(beacons, points):
+    """point_ranges(beacons,points) returns the (N,n) array with the distances of all N points to the n beacons."""
+    return np.linalg.norm(np.asarray(points, dtype=float)[:, None, :] - np.asarray(beacons, dtype=float), axis=-1)
+
+
+class Experiment:
+    """Experiment(beacons,points,noise_levels,trials,variant,seed,noise,project) is the specification of a Monte Carlo
+       experiment: every point of the (P,d) array points is measured trials times by the (n,d) beacons, for every
+       noise level. noise is a model of noise_models.py scaled by the noise level, by default Uniform(), so the noise
+       on a range is noise_level * uniform(-1, 1) as in tools.noise. seed is passed to np.random.default_rng,
+       so the same seed gives the same results. With project the closed form solvers return the closest approach
+       point for circles/spheres that just miss each other, so every trial gives an estimate."""
+
+    def __init__(self, beacons, points, noise_levels, trials=20, variant=3, seed=None, noise=None, project=False):
+        self.beacons = np.array(beacons, dtype=float)
+        self.points = np.array(points, dtype=float)
+        self.noise_levels = np.atleast_1d(np.array(noise_levels, dtype=float))
+        self.trials = int(trials)
+        self.variant = variant
+        self.seed = seed
+        self.noise = Uniform() if noise is None else noise
+        self.project = project
+
+    def noisy_ranges(self, rng):
+        """noisy_ranges(rng) returns the (levels, points, trials, beacons) array with noisy ranges, drawn from the
+           np.random.Generator rng."""
+        clean = point_ranges(self.beacons, self.points)[None, :, None, :]
+        shape = (len(self.noise_levels), len(self.points), self.trials, len(self.beacons))
+        return self.noise.apply(np.broadcast_to(clean, shape), rng, self.noise_levels[:, None, None, None])
+
+    def run(self, keep_positions=False, rng=None):
+        """run(keep_positions,rng) runs the experiment and returns an ExperimentResult,
+           with keep_positions the estimated positions are kept as well. The noise is drawn from the
+           np.random.Generator rng, by default from a new generator with the seed of the experiment."""
+        ranges = self.noisy_ranges(np.random.default_rng(self.seed) if rng is None else rng)
+        return self.solve_ranges(ranges, keep_positions)
+
+    def solve_ranges(self, ranges, keep_positions=False):
+        """solve_ranges(ranges,keep_positions) solves the (levels, points, trials, beacons) array of noisy ranges
+           and returns an ExperimentResult."""
+        position, status = solve(self.beacons, ranges.reshape(-1, len(self.beacons)), self.variant, self.project)
+        position = position.reshape(ranges.shape[:3] + (self.beacons.shape[1],))
+        errors = np.linalg.norm(position - self.points[None, :, None, :], axis=-1)
+        return ExperimentResult(self, errors, status.reshape(errors.shape), position if keep_positions else None)
+
+
+class ExperimentResult:
+    """ExperimentResult holds the (levels, points, trials) arrays errors (distance between estimated and true
+       point, nan when no solution was found) and status (status codes of the solver) of an Experiment."""
+
+    def __init__(self, experiment, errors, status, positions=None):
+        self.experiment = experiment
+        self.errors = errors
+        self.status = status
+        self.positions = positions
+
+    @property
+    def found(self):
+        """number of trials with a solution (or a projected estimate), per level and point"""
+        return np.sum((self.status == STATUS_OK) | (self.status == STATUS_PROJECTED), axis=-1)
+
+    @property
+    def mean_error(self):
+        """average error of the trials with a solution, per level and point, nan when none was found"""
+        with np.errstate(invalid='ignore'):
+            return np.nansum(self.errors, axis=-1) / self.found
+
+    def filled_mean_error(self):
+        """mean_error, with the noise level where no solution was found (as main.py did)"""
+        return np.where(self.found > 0, self.mean_error, self.experiment.noise_levels[:, None])
+
+    def level_error(self):
+        """average of filled_mean_error over all points, per noise level"""
+        return np.mean(self.filled_mean_error(), axis=1)
+
+    def statistics(self, names=('mean', 'std', 'rms', 'p95', 'found')):
+        """statistics(names) returns a dict with per level and point the mean, standard deviation, rms and 95th
+           percentile of the error and the fraction of trials with a solution, or only the statistics in names."""
+        functions = {'mean': lambda: self.mean_error,
+                     'std': lambda: np.nanstd(self.errors, axis=-1),
+                     'rms': lambda: np.sqrt(np.nanmean(self.errors ** 2, axis=-1)),
+                     'p95': lambda: np.nanpercentile(self.errors, 95, axis=-1),
+                     'found': lambda: self.found / self.experiment.trials}
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)  # points without any solution give nan
+            return {name: functions[name]() for name in names}
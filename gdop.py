@@ -0,0 +1,106 @@
+"""
+   Analytic error propagation for range based positioning
+
+   For small, independent range errors with standard deviation sigma the covariance of the (least squares)
+   position estimate in point x is sigma^2 (H^T H)^-1, in which the rows of H are the unit vectors from the
+   beacons to x, the Jacobian of the range equations. GDOP = sqrt(trace((H^T H)^-1)) and the expected error
+   magnitude follow from this covariance, for all points of a grid in one vectorized pass.
+   Uniform noise nd * uniform(-1, 1), as used by main.py, has sigma = nd / sqrt(3).
+   This is the error of an efficient estimator (refine.refine matches it closely), it is a lower bound for the
+   closed form solvers, e.g. variant 3 of trilaterate2d is close to it inside the beacon triangle but worse in
+   bad geometry.
+"""
+
+import math
+
+import numpy as np
+from experiment import Experiment
+from noise_models import Gaussian
+
+
+def geometry_matrix(beacons, points):
+    """geometry_matrix(beacons,points) returns the (P,d,d) array H^T H for all (P,d) points,
+       nan for points on a beacon."""
+    diff = np.asarray(points, dtype=float)[:, None, :] - np.asarray(beacons, dtype=float)
+    dist = np.linalg.norm(diff, axis=-1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        H = np.where(dist > 0, diff / dist, np.nan)
+    return np.swapaxes(H, 1, 2) @ H
+
+
+def covariance(beacons, points, sigma=1.0):
+    """covariance(beacons,points,sigma) returns the (P,d,d) covariance of the position error in all points for range
+       noise with standard deviation sigma, inf where the beacons give no position (e.g. all in one line with x)."""
+    HtH = geometry_matrix(beacons, points)
+    dim = HtH.shape[-1]
+    valid = np.all(np.isfinite(HtH), axis=(1, 2))
+    # ratio of the determinant and that of a perfectly conditioned matrix with the same trace
+    valid[valid] = np.linalg.det(HtH[valid]) > 1e-12 * (np.trace(HtH[valid], axis1=1, axis2=2) / dim) ** dim
+    cov = np.full(HtH.shape, np.inf)
+    cov[valid] = sigma ** 2 * np.linalg.inv(HtH[valid])
+    cov[~valid] = np.where(np.eye(dim, dtype=bool), np.inf, np.nan)
+    return cov
+
+
+def gdop(beacons, points):
+    """gdop(beacons,points) returns the geometric dilution of precision sqrt(trace((H^T H)^-1)) in all points."""
+    return np.sqrt(np.trace(covariance(beacons, points), axis1=1, axis2=2))
+
+
+def unit_directions(dim, n=None):
+    """unit_directions(dim,n) returns n (nearly) evenly spread unit vectors in 2D or 3D, by default 64 in 2D
+       (evenly spaced angles, exact for smooth periodic functions) and 256 in 3D."""
+    n = n or (64 if dim == 2 else 256)
+    if dim == 2:
+        theta = 2 * np.pi * np.arange(n) / n
+        return np.stack((np.cos(theta), np.sin(theta)), axis=-1)
+    # Fibonacci sphere
+    z = 1 - (2 * np.arange(n) + 1) / n
+    phi = np.pi * (3 - math.sqrt(5)) * np.arange(n)
+    r = np.sqrt(1 - z ** 2)
+    return np.stack((r * np.cos(phi), r * np.sin(phi), z), axis=-1)
+
+
+def expected_error(beacons, points, sigma=1.0):
+    """expected_error(beacons,points,sigma) returns the expected length of the position error E|e| in all points,
+       for a normally distributed error with the covariance of covariance(beacons, points, sigma).
+       With e = r u (u a uniformly distributed direction, r chi distributed) E|e| = E[r] mean_u sqrt(u^T C u)."""
+    cov = covariance(beacons, points, sigma)
+    dim = cov.shape[-1]
+    u = unit_directions(dim)
+    mean_r = math.sqrt(2) * math.exp(math.lgamma((dim + 1) / 2) - math.lgamma(dim / 2))
+    with np.errstate(invalid='ignore'):
+        # u^T C u for all points and directions as one matrix product
+        quadratic = np.where(np.isfinite(cov), cov, 0).reshape(len(cov), -1) @ (u[:, :, None] * u[:, None, :]).reshape(
+            len(u), -1).T
+        result = mean_r * np.mean(np.sqrt(np.maximum(quadratic, 0)), axis=1)
+    result[~np.all(np.isfinite(cov), axis=(1, 2))] = np.inf
+    return result
+
+
+def rms_error(beacons, points, sigma=1.0):
+    """rms_error(beacons,points,sigma) returns the root mean square position error sqrt(trace(C)) in all points."""
+    return sigma * gdop(beacons, points)
+
+
+def noise_relation(beacons, points, noise_levels, uniform=True):
+    """noise_relation(beacons,points,noise_levels,uniform) returns the expected error, averaged over all points,
+       for every noise level (the analytic version of the noise relation plot of main.py). With uniform the noise
+       levels are the nd of nd * uniform(-1, 1), else they are standard deviations. Points without a position
+       (where the expected error is infinite) are left out."""
+    error = expected_error(beacons, points)
+    scale = 1 / math.sqrt(3) if uniform else 1.0
+    return np.mean(error[np.isfinite(error)]) * scale * np.asarray(noise_levels, dtype=float)
+
+
+def validate(beacons, points, sigma=0.01, trials=200, variant='refine', seed=None):
+    """validate(beacons,points,sigma,trials,variant,seed) compares expected_error with a Monte Carlo experiment with
+       Gaussian range noise. Returns a dict with both mean errors per point and the median and 90th percentile of
+       the ratio Monte Carlo / analytic over the points where both are finite."""
+    analytic = expected_error(beacons, points, sigma)
+    result = Experiment(beacons, points, [sigma], trials, variant, seed, noise=Gaussian()).run()
+    monte_carlo = result.mean_error[0]
+    ratio = monte_carlo / analytic
+    ratio = ratio[np.isfinite(ratio)]
+    return {'analytic': analytic, 'monte_carlo': monte_carlo,
+            'median_ratio': np.median(ratio), 'p90_ratio': np.percentile(ratio, 90)}
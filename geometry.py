@@ -1,6 +1,9 @@
 """ 
    Set of functions for doing geometry, e.g. in 2D and 3D
 
+   Single 2D or 3D vectors (numpy arrays, tuples or lists) take a fast path with plain floats and the math
+   module, other input falls back to numpy. The *_batch functions work on (N,d) stacks of vectors.
+
    Developed for the course PosBep (Positiebepaling) at Mechatronics, 
    The Hague University of Applied Sciences
 
@@ -9,11 +12,78 @@
    Rufus Fraanje, GNU-GPLv3, 2021/05/01
 """
 
+import math
 import numpy as np
 
+# status codes returned by the batch solvers (one per row) instead of raising ValueError
+STATUS_OK = 0
+STATUS_NO_INTERSECTION = 1  # circles/spheres do not intersect
+STATUS_COINCIDENT = 2  # circles/spheres are equal
+STATUS_COLLINEAR = 3  # beacons on a straight line (or at the same location)
+STATUS_NO_SOLUTION = 4  # intersections found, but none is consistent with the other ranges
+STATUS_COPLANAR = 5  # 3D beacons in one plane
+STATUS_PROJECTED = 6  # no intersection, the closest approach point is returned (opt-in with project=True)
+STATUS_NOT_CONVERGED = 7  # the iterative solver did not converge within its iterations
+
+
+class TrilaterationError(ValueError):
+    """Error of the scalar solvers, reason is the category of the failure (counted by instrument.py)."""
+    reason = 'error'
+
+
+class NoIntersectionError(TrilaterationError):
+    """Circles/spheres do not intersect."""
+    reason = 'no_intersection'
+
+
+class CoincidentError(TrilaterationError):
+    """Circles/spheres are equal."""
+    reason = 'coincident_circles'
+
+
+class CollinearError(TrilaterationError):
+    """Beacons on a straight line."""
+    reason = 'collinear'
+
+
+class CoincidentBeaconsError(CollinearError):
+    """At least two beacons at the same location."""
+    reason = 'coincident_beacons'
+
+
+class NoSolutionError(TrilaterationError):
+    """Intersections found, but none is consistent with the other ranges."""
+    reason = 'no_solution'
+
+
+class CoplanarError(TrilaterationError):
+    """3D beacons in one plane."""
+    reason = 'coplanar'
+
+
+# default tolerances, the same as np.isclose: |a - b| <= ATOL + RTOL * |b|
+RTOL = 1e-5
+ATOL = 1e-8
+
+
+def as_floats(v):
+    """as_floats(v) returns v as a tuple of floats when it is a single 2D or 3D vector, else returns None."""
+    if isinstance(v, np.ndarray):
+        if v.ndim == 1 and v.shape[0] in (2, 3) and v.dtype.kind in 'iuf':
+            return tuple(v.tolist())
+    elif isinstance(v, (tuple, list)) and len(v) in (2, 3):
+        try:
+            return tuple(float(x) for x in v)
+        except TypeError:
+            return None
+    return None
+
 
 def length(v):
     """length(v) returns the length of vector v."""
+    f = as_floats(v)
+    if f is not None:
+        return 0.0 if all(abs(x) <= ATOL for x in f) else math.hypot(*f)
     if np.all(np.isclose(v, 0)):
         return 0.0
     else:
@@ -22,16 +92,27 @@ def length(v):
 
 def is_zero_length(v):
     """is_zero_length(v) returns True when all elements in vector v are zero."""
+    f = as_floats(v)
+    if f is not None:
+        return all(abs(x) <= ATOL for x in f)
     return np.all(np.isclose(v, 0))
 
 
 def is_equal(p1, p2):
     """is_equal(p1,p2) returns True of p1 and p2 are points or vectors with the same coordinates."""
+    f1, f2 = as_floats(p1), as_floats(p2)
+    if f1 is not None and f2 is not None and len(f1) == len(f2):
+        return all(abs(a - b) <= ATOL + RTOL * abs(b) for a, b in zip(f1, f2))
     return np.all(np.isclose(p1, p2))
 
 
 def distance(p1, p2):
     """distance(p1,p2) returns distance between p1 and p2."""
+    f1, f2 = as_floats(p1), as_floats(p2)
+    if f1 is not None and f2 is not None and len(f1) == len(f2):
+        if all(abs(a - b) <= ATOL + RTOL * abs(b) for a, b in zip(f1, f2)):
+            return 0.0
+        return math.dist(f1, f2)
     if np.all(np.isclose(p1, p2)):
         return 0.0
     else:
@@ -47,6 +128,10 @@ def projection_rejection_reflection(v, w):
        reflection of w in v is the vector w_f = w - 2 w_r, 
            so w_f = w_p - w_r, and w_f has same length as w, but mirrored in v.
     """
+    fv, fw = as_floats(v), as_floats(w)
+    if fv is not None and fw is not None and len(fv) == len(fw):
+        w_p, w_r, w_f = projection_rejection_reflection_floats(fv, fw)
+        return np.array(w_p), np.array(w_r), np.array(w_f)
 
     vw = np.dot(v, w)
     vv = np.dot(v, v)
@@ -61,8 +146,26 @@ def projection_rejection_reflection(v, w):
         return w_p, w_r, w_f
 
 
+def projection_rejection_reflection_floats(v, w):
+    """projection_rejection_reflection_floats(v,w) is projection_rejection_reflection for tuples of floats."""
+    vv = sum(a * a for a in v)
+    if abs(vv) <= ATOL:
+        raise ValueError('Vector v should not be of zero length.')
+    s = sum(a * b for a, b in zip(v, w)) / vv
+    w_p = tuple(s * a for a in v)
+    w_r = tuple(b - a for a, b in zip(w_p, w))
+    w_f = tuple(b - 2 * a for a, b in zip(w_r, w))
+    return w_p, w_r, w_f
+
+
 def normalized(v):
     """normalized(v) returns the unit-vector with the same direction as v."""
+    f = as_floats(v)
+    if f is not None:
+        if all(abs(x) <= ATOL for x in f):
+            raise ValueError('Vector v should not be of zero length.')
+        n = math.hypot(*f)
+        return np.array([x / n for x in f])
     if is_zero_length(v):
         raise ValueError('Vector v should not be of zero length.')
     else:
@@ -72,6 +175,9 @@ def normalized(v):
 def is_collinear(p1, p2, p3):
     """is_collinear(p1,p2,p3) returns True of p1, p2 and p3 lay on a straight line
     (i.e. they are collinear), else returns False."""
+    f1, f2, f3 = as_floats(p1), as_floats(p2), as_floats(p3)
+    if f1 is not None and f2 is not None and f3 is not None and len(f1) == len(f2) == len(f3):
+        return is_collinear_floats(f1, f2, f3)
 
     # first check if at least two points are the same, then for sure the points are collinear:
     if is_equal(p1, p2) or is_equal(p1, p3) or is_equal(p2, p3):
@@ -82,8 +188,32 @@ def is_collinear(p1, p2, p3):
         return is_zero_length(p3_rej_p1_p2)
 
 
+def is_collinear_floats(p1, p2, p3):
+    """is_collinear_floats(p1,p2,p3) is is_collinear for tuples of floats."""
+    def equal(a, b):
+        return all(abs(x - y) <= ATOL + RTOL * abs(y) for x, y in zip(a, b))
+
+    if equal(p1, p2) or equal(p1, p3) or equal(p2, p3):
+        return True
+    _, p3_rej_p1_p2, _ = projection_rejection_reflection_floats(tuple(b - a for a, b in zip(p1, p2)),
+                                                                tuple(c - a for a, c in zip(p1, p3)))
+    return all(abs(x) <= ATOL for x in p3_rej_p1_p2)
+
+
 def is_coplanar(p1, p2, p3, p4):
     """is_coplanar(p1,p2,p3,p4) returns True of p1, p2, p3 and p4 are all in one plane, else returns False."""
+    f = [as_floats(p) for p in (p1, p2, p3, p4)]
+    if all(x is not None and len(x) == 3 for x in f):
+        f1, f2, f3, f4 = f
+        if is_collinear_floats(f1, f2, f3) or is_collinear_floats(f1, f2, f4) or is_collinear_floats(f1, f3, f4) \
+                or is_collinear_floats(f2, f3, f4):
+            return True
+        a = tuple(y - x for x, y in zip(f1, f2))
+        b = tuple(y - x for x, y in zip(f1, f3))
+        v = (a[1] * b[2] - a[2] * b[1], a[2] * b[0] - a[0] * b[2], a[0] * b[1] - a[1] * b[0])
+        p41_proj_v, _, _ = projection_rejection_reflection_floats(v, tuple(y - x for x, y in zip(f1, f4)))
+        return all(abs(x) <= ATOL for x in p41_proj_v)
+
     # first check if at least three points are collinear:
     if is_collinear(p1, p2, p3) or is_collinear(p1, p2, p4) or is_collinear(p1, p3, p4) or is_collinear(p2, p3, p4):
         return True
@@ -102,15 +232,16 @@ def nearest_points(*pairs):
     indices = np.zeros(num_points, dtype=np.int8)
 
     # first check first two pairs
-    dist = np.argsort([distance(pairs[0][0], pairs[1][0]),
-                       distance(pairs[0][0], pairs[1][1]),
-                       distance(pairs[0][1], pairs[1][0]),
-                       distance(pairs[0][1], pairs[1][1])])
-    if dist[0] == 0:
+    dist = [distance(pairs[0][0], pairs[1][0]),
+            distance(pairs[0][0], pairs[1][1]),
+            distance(pairs[0][1], pairs[1][0]),
+            distance(pairs[0][1], pairs[1][1])]
+    best = dist.index(min(dist))
+    if best == 0:
         indices[0], indices[1] = 0, 0
-    elif dist[0] == 1:
+    elif best == 1:
         indices[0], indices[1] = 0, 1
-    elif dist[0] == 2:
+    elif best == 2:
         indices[0], indices[1] = 1, 0
     else:
         indices[0], indices[1] = 1, 1
@@ -121,3 +252,104 @@ def nearest_points(*pairs):
         indices[n + 2] = 0 if (distance(reference, pairs[n + 2][0]) <= distance(reference, pairs[n + 2][1])) else 1
 
     return indices
+
+
+def nearest_points_mean(*pairs):
+    """nearest_points_mean(*pairs) returns the average of the points selected by nearest_points as a tuple,
+    for pairs of points given as plain tuples of floats (much faster than numpy for single 2D or 3D points)."""
+    (a0, a1), (b0, b1) = pairs[0], pairs[1]
+    dist = [math.dist(a0, b0), math.dist(a0, b1), math.dist(a1, b0), math.dist(a1, b1)]
+    best = dist.index(min(dist))
+    reference = pairs[0][best // 2]
+    chosen = [reference, pairs[1][best % 2]]
+    for p0, p1 in pairs[2:]:
+        chosen.append(p0 if math.dist(reference, p0) <= math.dist(reference, p1) else p1)
+    return tuple(sum(coordinate) / len(chosen) for coordinate in zip(*chosen))
+
+
+def nearest_points_batch(*pairs):
+    """nearest_points_batch(*pairs) is the array version of nearest_points: every pair is a tuple (p1, p2)
+    of (N,d) arrays, the result is an (N, len(pairs)) array with indices 0 or 1 for every row."""
+    num_points = len(pairs)
+    indices = np.zeros((len(pairs[0][0]), num_points), dtype=np.int8)
+
+    # first check first two pairs, order of the distances is 00, 01, 10, 11 as in nearest_points
+    dist = np.stack([np.linalg.norm(pairs[0][i] - pairs[1][j], axis=-1) for i in (0, 1) for j in (0, 1)], axis=-1)
+    best = np.argmin(dist, axis=-1)
+    indices[:, 0] = best // 2
+    indices[:, 1] = best % 2
+
+    # compare the remaining pairs using the selected point in the first pair as reference
+    reference = select_points(pairs[0], indices[:, 0])
+    for n in range(num_points - 2):
+        indices[:, n + 2] = (np.linalg.norm(reference - pairs[n + 2][0], axis=-1) >
+                             np.linalg.norm(reference - pairs[n + 2][1], axis=-1))
+
+    return indices
+
+
+def select_points(pair, index):
+    """select_points(pair,index) returns for every row the point pair[0] (index 0) or pair[1] (index 1)."""
+    return np.where(np.reshape(index, (-1, 1)) == 0, pair[0], pair[1])
+
+
+def length_batch(v):
+    """length_batch(v) returns the lengths of all vectors (rows) in the (N,d) array v."""
+    return np.linalg.norm(v, axis=-1)
+
+
+def is_zero_length_batch(v, atol=ATOL):
+    """is_zero_length_batch(v,atol) returns True for all rows of v of which all elements are zero (within atol)."""
+    return np.all(np.abs(v) <= atol, axis=-1)
+
+
+def is_equal_batch(p1, p2, rtol=RTOL, atol=ATOL):
+    """is_equal_batch(p1,p2,rtol,atol) returns True for all rows in which p1 and p2 have the same coordinates."""
+    return np.all(np.isclose(p1, p2, rtol=rtol, atol=atol), axis=-1)
+
+
+def distance_batch(p1, p2):
+    """distance_batch(p1,p2) returns the distances between all rows of p1 and p2."""
+    return np.linalg.norm(np.subtract(p1, p2), axis=-1)
+
+
+def projection_rejection_reflection_batch(v, w, atol=ATOL):
+    """projection_rejection_reflection_batch(v,w,atol) returns the projection, rejection and reflection of all rows
+       of w on/in the rows of v (see projection_rejection_reflection). Rows where v has zero length are nan."""
+    v, w = np.asarray(v, dtype=float), np.asarray(w, dtype=float)
+    vw = np.sum(v * w, axis=-1)
+    vv = np.sum(v * v, axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        s = np.where(np.abs(vv) <= atol, np.nan, vw / vv)
+    w_p = s[..., None] * v
+    w_r = w - w_p
+    w_f = w - 2 * w_r
+    return w_p, w_r, w_f
+
+
+def normalized_batch(v, atol=ATOL):
+    """normalized_batch(v,atol) returns the unit-vectors with the same direction as the rows of v,
+       rows of zero length are nan."""
+    v = np.asarray(v, dtype=float)
+    n = np.linalg.norm(v, axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return v / np.where(is_zero_length_batch(v, atol), np.nan, n)[..., None]
+
+
+def is_collinear_batch(p1, p2, p3, rtol=RTOL, atol=ATOL):
+    """is_collinear_batch(p1,p2,p3,rtol,atol) returns True for all rows in which p1, p2 and p3 are collinear."""
+    p1, p2, p3 = np.broadcast_arrays(*(np.asarray(p, dtype=float) for p in (p1, p2, p3)))
+    same = is_equal_batch(p1, p2, rtol, atol) | is_equal_batch(p1, p3, rtol, atol) | is_equal_batch(p2, p3, rtol, atol)
+    _, p3_rej_p1_p2, _ = projection_rejection_reflection_batch(p2 - p1, p3 - p1, atol)
+    return same | is_zero_length_batch(p3_rej_p1_p2, atol)
+
+
+def is_coplanar_batch(p1, p2, p3, p4, rtol=RTOL, atol=ATOL):
+    """is_coplanar_batch(p1,p2,p3,p4,rtol,atol) returns True for all rows in which the 3D points p1..p4 are
+       in one plane."""
+    p1, p2, p3, p4 = np.broadcast_arrays(*(np.asarray(p, dtype=float) for p in (p1, p2, p3, p4)))
+    collinear = (is_collinear_batch(p1, p2, p3, rtol, atol) | is_collinear_batch(p1, p2, p4, rtol, atol) |
+                 is_collinear_batch(p1, p3, p4, rtol, atol) | is_collinear_batch(p2, p3, p4, rtol, atol))
+    v = np.cross(p2 - p1, p3 - p1)
+    p41_proj_v, _, _ = projection_rejection_reflection_batch(v, p4 - p1, atol)
+    return collinear | is_zero_length_batch(p41_proj_v, atol)
@@ -0,0 +1,189 @@
+"""
+   Opt-in instrumentation of the solvers
+
+   When enabled, the solvers add the time of their stages (validation, intersection, disambiguation, averaging)
+   to timings and count the outcome of every fix per beacon layout in counters: 'ok' or the reason of the failure
+   (the reason of the TrilaterationError of the scalar solvers, or the status code of the batch solvers).
+   When disabled (the default) the solvers only pay a few function calls that return immediately.
+
+   instrument.enable()
+   experiment.run()
+   print(instrument.snapshot())
+
+   profiled(name) wraps a block of code in the profiler hook, e.g. CProfileHook, sweep.sweep profiles every chunk.
+"""
+
+import contextlib
+import cProfile
+import functools
+import inspect
+import json
+import os
+import time
+
+import numpy as np
+from geometry import *
+
+enabled = False
+timings = {}  # stage -> [calls, total seconds, max seconds]
+counters = {}  # layout -> {reason: count}
+profiler = None  # callable(name) that returns a context manager, used by profiled
+
+REASONS = {STATUS_OK: 'ok', STATUS_NO_INTERSECTION: 'no_intersection', STATUS_COINCIDENT: 'coincident_circles',
+           STATUS_COLLINEAR: 'collinear', STATUS_NO_SOLUTION: 'no_solution', STATUS_COPLANAR: 'coplanar',
+           STATUS_PROJECTED: 'projected', STATUS_NOT_CONVERGED: 'not_converged'}
+
+
+def enable():
+    """enable() starts recording timings and counters."""
+    global enabled
+    enabled = True
+
+
+def disable():
+    """disable() stops recording, the recorded values are kept."""
+    global enabled
+    enabled = False
+
+
+def reset():
+    """reset() clears all timings and counters."""
+    timings.clear()
+    counters.clear()
+
+
+@contextlib.contextmanager
+def recording(clear=True):
+    """recording(clear) is a context manager that enables instrumentation in its block (after reset when clear)
+       and restores the previous state afterwards."""
+    global enabled
+    previous = enabled
+    if clear:
+        reset()
+    enabled = True
+    try:
+        yield
+    finally:
+        enabled = previous
+
+
+def start():
+    """start() returns the current time when instrumentation is enabled, else None."""
+    return time.perf_counter() if enabled else None
+
+
+def stop(stage, started):
+    """stop(stage,started) adds the time since started (as returned by start or stop) to stage and returns the
+       current time, so consecutive stages can be chained. Does nothing when started is None."""
+    if started is None:
+        return None
+    now = time.perf_counter()
+    entry = timings.get(stage)
+    if entry is None:
+        timings[stage] = [1, now - started, now - started]
+    else:
+        entry[0] += 1
+        entry[1] += now - started
+        entry[2] = max(entry[2], now - started)
+    return now
+
+
+def layout_key(beacons):
+    """layout_key(beacons) returns the beacon coordinates as a string, the key of a layout in counters."""
+    return str(np.round(np.asarray(beacons, dtype=float), 6).tolist())
+
+
+def count(beacons, reason, n=1):
+    """count(beacons,reason,n) adds n to the counter of reason for the layout beacons."""
+    layout = counters.setdefault(layout_key(beacons), {})
+    layout[reason] = layout.get(reason, 0) + n
+
+
+def count_status(beacons, status):
+    """count_status(beacons,status) counts the status codes of a batch solver for the layout beacons."""
+    if not enabled:
+        return
+    codes = np.bincount(np.ravel(status), minlength=len(REASONS))
+    for code in np.flatnonzero(codes):
+        count(beacons, REASONS.get(code, str(code)), int(codes[code]))
+
+
+def counts_outcomes(n_beacons):
+    """counts_outcomes(n_beacons) is a decorator for the scalar solvers, of which the first n_beacons parameters
+       are the beacons (passed by position or by keyword). It counts 'ok' or the reason of the TrilaterationError
+       of every call."""
+
+    def decorate(function):
+        signature = inspect.signature(function)
+        names = list(signature.parameters)[:n_beacons]
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return function(*args, **kwargs)
+            arguments = signature.bind(*args, **kwargs).arguments
+            beacons = [arguments[name] for name in names]
+            try:
+                result = function(*args, **kwargs)
+            except TrilaterationError as e:
+                count(beacons, e.reason)
+                raise
+            count(beacons, 'ok')
+            return result
+
+        return wrapper
+
+    return decorate
+
+
+def merge(other):
+    """merge(other) adds a snapshot of another process (e.g. a worker of a sweep) to the timings and counters."""
+    for stage, values in other['timings'].items():
+        entry = timings.setdefault(stage, [0, 0.0, 0.0])
+        entry[0] += values['calls']
+        entry[1] += values['total']
+        entry[2] = max(entry[2], values['max'])
+    for layout, reasons in other['counters'].items():
+        for reason, n in reasons.items():
+            counters.setdefault(layout, {})
+            counters[layout][reason] = counters[layout].get(reason, 0) + n
+
+
+def snapshot():
+    """snapshot() returns a dict with per stage the number of calls and the total, mean and maximum time in seconds,
+       and per layout the counters of the outcomes."""
+    return {'timings': {stage: {'calls': calls, 'total': total, 'mean': total / calls, 'max': longest}
+                        for stage, (calls, total, longest) in sorted(timings.items())},
+            'counters': {layout: dict(sorted(reasons.items())) for layout, reasons in counters.items()}}
+
+
+def export(path):
+    """export(path) writes the snapshot to the JSON file path."""
+    with open(path, 'w') as f:
+        json.dump(snapshot(), f, indent=1)
+
+
+def profiled(name):
+    """profiled(name) returns the context manager of the profiler hook for the block of code name,
+       or a context manager that does nothing when no hook is set."""
+    return profiler(name) if profiler is not None else contextlib.nullcontext()
+
+
+class CProfileHook:
+    """CProfileHook(directory) is a profiler hook that profiles every block with cProfile and writes the statistics
+       to directory/name.prof (read them with pstats or snakeviz). It can be pickled, so it can be passed to the
+       workers of a sweep."""
+
+    def __init__(self, directory='Profiles'):
+        self.directory = directory
+
+    @contextlib.contextmanager
+    def __call__(self, name):
+        os.makedirs(self.directory, exist_ok=True)
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield profile
+        finally:
+            profile.disable()
+            profile.dump_stats(os.path.join(self.directory, name + '.prof'))
@@ -0,0 +1,123 @@
+"""
+   Range to position lookup tables for fixed beacon layouts
+
+   For a fixed layout the position is a smooth function of the ranges, so it can be precomputed on a regular
+   grid in range space (3 ranges in 2D, 4 in 3D) with the closed form solvers and looked up with multilinear
+   interpolation. The table is stored as a float32 .npy file (memory-mappable) with a .json file with the grid.
+   Queries outside the table, in cells with a corner without solution, or in cells where the positions of the
+   corners are far apart (where the solver jumps from one intersection point to the other) are solved exactly.
+"""
+
+import itertools
+import json
+
+import numpy as np
+from experiment import point_ranges, solve
+from geometry import STATUS_OK
+
+
+class RangeLookup:
+    """RangeLookup(beacons,origin,step,table,error_bound,variant,max_spread) interpolates the position for ranges
+       in the table, an array with shape (n_1, .., n_k, d) with the positions for the ranges origin + index * step
+       (nan when there is no solution). Cells in which the corner positions differ more than max_spread (default
+       4 * step) in a coordinate are not interpolated. error_bound is the largest interpolation error found when
+       the table was built. Use RangeLookup.build to make a table and RangeLookup.load to read a saved one."""
+
+    def __init__(self, beacons, origin, step, table, error_bound=np.nan, variant=3, max_spread=None):
+        self.beacons = np.array(beacons, dtype=float)
+        self.origin = np.array(origin, dtype=float)
+        self.step = float(step)
+        self.table = table
+        self.error_bound = float(error_bound)
+        self.variant = variant
+        self.max_spread = 4 * self.step if max_spread is None else float(max_spread)
+        self.shape = np.array(table.shape[:-1])
+        # offsets of the 2^k corners of a cell, as flat index in the table
+        self.corners = np.array(list(itertools.product((0, 1), repeat=len(self.shape))))
+        self.corner_index = np.ravel_multi_index(self.corners.T, self.shape)
+
+    @classmethod
+    def build(cls, beacons, lower, upper, step, variant=3, max_spread=None, chunk_size=65536, samples=20000, seed=0):
+        """build(beacons,lower,upper,step,variant,max_spread,chunk_size,samples,seed) computes the table for the
+           workspace box between the corners lower and upper, with range step step. The error bound is the largest
+           difference between interpolation and exact solution in the centres of samples random cells."""
+        beacons = np.asarray(beacons, dtype=float)
+        axes = [np.linspace(lo, hi, 21) for lo, hi in zip(lower, upper)]
+        box = np.stack(np.meshgrid(*axes, indexing='ij'), axis=-1).reshape(-1, len(axes))
+        ranges = point_ranges(beacons, box)
+        origin = np.maximum(ranges.min(axis=0) - step, 0)
+        shape = np.ceil((ranges.max(axis=0) + step - origin) / step).astype(int) + 1
+
+        table = np.empty(tuple(shape) + (beacons.shape[1],), dtype=np.float32)
+        flat = table.reshape(-1, beacons.shape[1])
+        n = int(np.prod(shape))
+        for start in range(0, n, chunk_size):
+            index = np.stack(np.unravel_index(np.arange(start, min(start + chunk_size, n)), shape), axis=-1)
+            flat[start:start + len(index)], _ = solve(beacons, origin + step * index, variant)
+
+        lookup = cls(beacons, origin, step, table, variant=variant, max_spread=max_spread)
+        lookup.error_bound = lookup.measure_error(samples, seed)
+        return lookup
+
+    def measure_error(self, samples=20000, seed=0):
+        """measure_error(samples,seed) returns the largest distance between interpolation and exact solution in the
+           centres of samples random cells of which all corners have a solution."""
+        rng = np.random.default_rng(seed)
+        cells = rng.integers(0, self.shape - 1, (samples, len(self.shape)))
+        ranges = self.origin + self.step * (cells + 0.5)
+        position, in_table = self.interpolate(ranges)
+        exact, status = solve(self.beacons, ranges[in_table], self.variant)
+        error = np.linalg.norm(position[in_table] - exact, axis=1)[status == STATUS_OK]
+        return float(np.max(error)) if error.size else np.nan
+
+    def interpolate(self, ranges):
+        """interpolate(ranges) returns the interpolated positions for the (N,k) ranges and a boolean array which is
+           True for the rows inside the table (all cell corners with a solution), the other rows are nan."""
+        ranges = np.atleast_2d(np.asarray(ranges, dtype=float))
+        x = (ranges - self.origin) / self.step
+        cell = np.floor(x).astype(int)
+        inside = np.all((cell >= 0) & (cell < self.shape - 1), axis=1)
+        cell[~inside] = 0
+        frac = x - cell
+
+        # all corner values at once, (N, 2^k, d), the first range varies slowest over the corners
+        base = np.ravel_multi_index(cell.T, self.shape)
+        values = self.table.reshape(-1, self.table.shape[-1])[base[:, None] + self.corner_index]
+        corner_values = np.swapaxes(values, 1, 2).reshape(-1, values.shape[1])  # contiguous corners, fast reductions
+        with np.errstate(invalid='ignore'):
+            spread = np.max((corner_values.max(axis=1) - corner_values.min(axis=1)).reshape(len(values), -1), axis=1)
+        valid = inside & (spread <= self.max_spread)  # False for nan corners as well
+
+        # multilinear interpolation as linear interpolations along one range at a time
+        for axis in range(len(self.shape)):
+            half = values.shape[1] // 2
+            values = values[:, :half] + frac[:, axis, None, None] * (values[:, half:] - values[:, :half])
+        position = values[:, 0].astype(float)
+        position[~valid] = np.nan
+        return position, valid
+
+    def query(self, ranges):
+        """query(ranges) returns the positions for the (N,k) ranges and their status codes. Rows outside the table
+           are solved exactly, the third returned array is True for the rows that were interpolated."""
+        ranges = np.atleast_2d(np.asarray(ranges, dtype=float))
+        position, in_table = self.interpolate(ranges)
+        status = np.full(len(ranges), STATUS_OK, dtype=np.int8)
+        if not np.all(in_table):
+            position[~in_table], status[~in_table] = solve(self.beacons, ranges[~in_table], self.variant)
+        return position, status, in_table
+
+    def save(self, path):
+        """save(path) writes the table to path.npy and the grid to path.json."""
+        np.save(path + '.npy', self.table)
+        with open(path + '.json', 'w') as f:
+            json.dump({'beacons': self.beacons.tolist(), 'origin': self.origin.tolist(), 'step': self.step,
+                       'error_bound': self.error_bound, 'variant': self.variant, 'max_spread': self.max_spread}, f,
+                      indent=1)
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """load(path,mmap_mode) reads a table written by save, memory-mapped by default."""
+        with open(path + '.json') as f:
+            meta = json.load(f)
+        return cls(meta['beacons'], meta['origin'], meta['step'], np.load(path + '.npy', mmap_mode=mmap_mode),
+                   meta['error_bound'], meta['variant'], meta['max_spread'])
@@ -8,120 +8,210 @@ bakens is dan een gelijkbenige driehoek die precies in het werkgebied past.
 Vraag 8: Uit de grafiek is af te lezen dat standaard deviatie kleiner moet zijn dan 0.02 [m].
 Vraag 9: https://www.geodirect.nl/wp-content/uploads/2021/03/S900Anew_Brochure_ENG.pdf
 
-Bas Holweg, Bram Nijhoff 
+Bas Holweg, Bram Nijhoff
 10-06-2021
+
+Usage:
+python main.py [--experiment noise|map] [--layout 1|2] [--beacons X,Y ...] [--grid X_SIZE Y_SIZE [Z_SIZE]]
+               [--spacing S] [--noise LEVEL ...] [--trials N] [--variant 1|2|3|lstsq|refine] [--seed N] [--project]
+               [--workers N] [--output results.csv|results.npz] [--format csv|npz] [--show] [--save-plots DIR]
+
+The noise experiment gives the average error per noise level (noise relation), the map experiment the error per
+grid point for one noise level (error map). Without --show or --save-plots nothing is plotted and matplotlib is not
+imported, so compute only runs on machines without a display start fast. Without --output the average error per
+noise level is printed.
 """
 
-import matplotlib.pyplot as plt
+import argparse
+import sys
+
 import numpy as np
-from plotter import plot_diff
-from geometry import distance
-from tools import create_grid, noise, array_to_point_dist
-from trilaterate2d import trilaterate
-
-version = 1
-show_plots = True  # Used for debugging
-variable_deviation = True  # If True it plots the noise relation else it plots a 3d graph of the set deviation
-
-ex_count = 20  # Number of experements done per point
-
-if variable_deviation:
-    nd_list = np.linspace(0.01, 0.1, 10)
-else:
-    nd_list = [0.01]
-
-# Used for version 1
-x_space = np.linspace(0, 60, 60)
-y_space = np.linspace(0, 40, 40)
-b1 = np.array([15, 15])
-b2 = np.array([30, 35])
-b3 = np.array([45, 15])
-
-# Used for version 2
-x_size, y_size = 60, 40
-coordinates = create_grid(x_size, y_size)
-b12 = np.array([int(x_size / 4), int(y_size / 4)])
-b22 = np.array([int(x_size / 2), int(2 * y_size / 3)])
-b32 = np.array([int(2 * x_size / 3), int(y_size / 4)])
-
-fig, ax = plt.subplots()
-fig2, ax2 = plt.subplots()
-
-if version == 1:
-    # Plots the beacons
-    ax.scatter(b1[0], b1[1])
-    ax.scatter(b2[0], b2[1])
-    ax.scatter(b3[0], b3[1])
-
-    total_diff = []
-    for nd in nd_list:
-        total_diff_sum = 0
-        diff = []
-        point_list = []
-        for x in x_space:
-            for y in y_space:
-                point = np.array([x, y])
-                point_list.append(point)
-                dist_array = array_to_point_dist([b1, b2, b3], point)
-                if len(nd_list) == 1: ax.scatter(x, y, marker='+',c='r')  # Only plot if there is one deviation value
-                # to prevent multiple plots showing and slowing down the program
-                diff_sum = 0
-                count = 0
-                for q in range(ex_count):
-                    dist_array = noise(dist_array, nd)
-                    try:
-                        pre = trilaterate(b1, b2, b3, dist_array[0], dist_array[1], dist_array[2], variant=3)
-                        diff_sum += distance(pre, point)
-                        count += 1
-                        if len(nd_list) == 1: ax.scatter(pre[0], pre[1], marker='x', c='grey')
-                    except ValueError:
-                        continue
-                if count != 0:  # If there are points found add the average deviation to list
-                    diff.append(diff_sum / count)
-                else:  # If no points are found assume standard deviation
-                    diff.append(nd)  #TODO change to maximum possible distance from point with noise
-        if len(nd_list) == 1: plot_diff(point_list, diff)
-        total_diff.append(sum(diff) / len(diff))
-    if len(nd_list) > 1:
-        ax2.plot(nd_list, total_diff)
+from tools import create_grid
+from experiment import Experiment
+from sweep import sweep
+
+LAYOUTS = {
+    # version 1: beacons of the assignment, 60 x 40 points spread over 60 x 40 m
+    1: (np.array([[15, 15], [30, 35], [45, 15]]),
+        np.array([[x, y] for x in np.linspace(0, 60, 60) for y in np.linspace(0, 40, 40)])),
+    # version 2: beacons relative to the size of the grid, points every metre
+    2: (np.array([[60 // 4, 40 // 4], [60 // 2, 2 * 40 // 3], [2 * 60 // 3, 40 // 4]]), create_grid(60, 40))}
+
+NOISE_LEVELS = {'noise': np.linspace(0.01, 0.1, 10), 'map': [0.01]}
+STATISTICS = ('mean', 'std', 'rms', 'p95', 'found')
+
+
+def coordinates(text):
+    """coordinates(text) returns the coordinates of a beacon given as 'x,y' or 'x,y,z'."""
+    try:
+        return [float(value) for value in text.split(',')]
+    except ValueError:
+        raise argparse.ArgumentTypeError('Beacon coordinates are given as x,y or x,y,z, not {!r}.'.format(text))
+
+
+def variant(text):
+    """variant(text) returns the solver variant of experiment.solve, 1, 2, 3, 'lstsq' or 'refine'."""
+    if text in ('1', '2', '3'):
+        return int(text)
+    if text in ('lstsq', 'refine'):
+        return text
+    raise argparse.ArgumentTypeError('Unknown variant {!r}, use 1, 2, 3, lstsq or refine.'.format(text))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Monte Carlo experiments of the trilateration solvers.')
+    parser.add_argument('--experiment', choices=('noise', 'map'), default='noise',
+                        help='average error per noise level (noise) or error per grid point (map)')
+    parser.add_argument('--layout', type=int, choices=sorted(LAYOUTS), default=1,
+                        help='beacons and grid of the assignment (version 1 or 2)')
+    parser.add_argument('--beacons', type=coordinates, nargs='+', metavar='X,Y',
+                        help='beacon coordinates instead of those of the layout (3 in 2D, 4 in 3D for variant 1-3)')
+    parser.add_argument('--grid', type=int, nargs='+', metavar='SIZE',
+                        help='grid of tools.create_grid (X_SIZE Y_SIZE [Z_SIZE]) instead of that of the layout')
+    parser.add_argument('--spacing', type=float, default=1.0, help='distance between the points of --grid [m]')
+    parser.add_argument('--noise', type=float, nargs='+', metavar='LEVEL',
+                        help='noise levels [m] (default 0.01 .. 0.1 for noise, 0.01 for map)')
+    parser.add_argument('--trials', type=int, default=20, help='experiments per point and noise level')
+    parser.add_argument('--variant', type=variant, default=3, help='solver variant: 1, 2, 3, lstsq or refine')
+    parser.add_argument('--seed', type=int, help='seed of the noise, the same seed gives the same results')
+    parser.add_argument('--project', action='store_true',
+                        help='circles that just miss each other give their closest approach point')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='processes of sweep.sweep (default 0 runs in this process), does not change the results')
+    parser.add_argument('--output', help='file for the results, csv or npz')
+    parser.add_argument('--format', choices=('csv', 'npz'), help='format of --output (default: its extension)')
+    parser.add_argument('--show', action='store_true', help='show the plots')
+    parser.add_argument('--save-plots', nargs='?', const='Plots', metavar='DIR',
+                        help='write the plots to DIR (default Plots) without opening windows')
+    args = parser.parse_args(argv)
+
+    if args.grid is not None and len(args.grid) not in (2, 3):
+        parser.error('--grid takes X_SIZE Y_SIZE or X_SIZE Y_SIZE Z_SIZE')
+    if args.beacons is not None and len({len(beacon) for beacon in args.beacons}) != 1:
+        parser.error('all beacons need the same number of coordinates')
+    if args.output is not None and args.format is None:
+        args.format = 'npz' if args.output.endswith('.npz') else 'csv'
+    if args.trials < 1:
+        parser.error('--trials should be at least 1')
+
+    beacons = LAYOUTS[args.layout][0] if args.beacons is None else args.beacons
+    n, dim = len(beacons), len(beacons[0])
+    grid_dim = 2 if args.grid is None else len(args.grid)
+    if dim not in (2, 3):
+        parser.error('beacons have 2 (x,y) or 3 (x,y,z) coordinates')
+    if dim != grid_dim:
+        parser.error('{}D beacons need a {}D grid, give --grid with {} sizes'.format(dim, dim, dim))
+    if args.variant in (1, 2, 3) and (n, dim) not in ((3, 2), (4, 3)):
+        parser.error('variant {} needs 3 beacons in 2D or 4 in 3D, use --variant lstsq or refine for {} beacons'
+                     .format(args.variant, n))
+    if n <= dim:
+        parser.error('at least {} beacons are needed in {}D'.format(dim + 1, dim))
+    if dim == 3 and (args.show or args.save_plots):
+        parser.error('the plots are 2D only, use --output for 3D layouts')
+    return args
+
+
+def build_experiment(args):
+    """build_experiment(args) returns the Experiment for the parsed arguments."""
+    beacons, points = LAYOUTS[args.layout]
+    if args.beacons is not None:
+        beacons = np.array(args.beacons)
+    if args.grid is not None:
+        points = create_grid(*args.grid) * args.spacing
+    noise_levels = NOISE_LEVELS[args.experiment] if args.noise is None else args.noise
+    return Experiment(beacons, points, noise_levels, trials=args.trials, variant=args.variant, seed=args.seed,
+                      project=args.project)
+
+
+def run(experiment, keep_positions=False, workers=0):
+    """run(experiment,keep_positions,workers) runs the experiment with sweep.sweep in workers processes (0 runs in
+       this process) and returns the ExperimentResult. The noise of every chunk of points is drawn from the seed
+       as in sweep, so the number of workers does not change the results."""
+    return sweep([experiment.beacons], experiment.points, experiment.noise_levels, experiment.trials,
+                 experiment.variant, experiment.seed, workers=workers, noise=experiment.noise,
+                 project=experiment.project, keep_positions=keep_positions)[0]
+
+
+def write_csv(path, result):
+    """write_csv(path,result) writes a row per noise level and point with the statistics of the ExperimentResult."""
+    experiment = result.experiment
+    statistics = result.statistics(STATISTICS)
+    n_levels, n_points = len(experiment.noise_levels), len(experiment.points)
+    names = ['noise'] + ['x', 'y', 'z'][:experiment.points.shape[1]] + list(STATISTICS)
+    columns = [np.repeat(experiment.noise_levels, n_points)[:, None],
+               np.tile(experiment.points, (n_levels, 1))] + [statistics[name].reshape(-1, 1) for name in STATISTICS]
+    np.savetxt(path, np.hstack(columns), delimiter=',', header=','.join(names), comments='', fmt='%.9g')
+
+
+def write_npz(path, result):
+    """write_npz(path,result) writes the specification, the (levels, points, trials) errors and status codes and the
+       (levels, points) statistics of the ExperimentResult."""
+    experiment = result.experiment
+    arrays = {'beacons': experiment.beacons, 'points': experiment.points, 'noise_levels': experiment.noise_levels,
+              'trials': experiment.trials, 'variant': str(experiment.variant), 'errors': result.errors,
+              'status': result.status}
+    arrays.update(result.statistics(STATISTICS))
+    if result.positions is not None:
+        arrays['positions'] = result.positions
+    np.savez_compressed(path, **arrays)
+
+
+def plot(result, name, save_plots=None):
+    """plot(result,name,save_plots) plots the layout and the noise relation (several noise levels) or the error map
+       (one noise level) of the ExperimentResult, the figures are written to the directory save_plots when given,
+       else they are shown. matplotlib is only imported here."""
+    import matplotlib.pyplot as plt
+    from plotter import Layers, export_all, headless, plot_diff, plot_error_map
+
+    if save_plots:
+        headless()
+    experiment = result.experiment
+    points, noise_levels = experiment.points, experiment.noise_levels
+    fig, ax = plt.subplots()
+    fig2, ax2 = plt.subplots()
+    figures = {f'layout_{name}': fig}
+
+    # Plots the beacons, grid points and estimates, one scatter call per layer
+    layers = Layers()
+    layers.add('beacons', experiment.beacons, zorder=3)
+    if len(noise_levels) == 1:  # Only plot if there is one deviation value to prevent multiple plots showing
+        diff = result.filled_mean_error()  # If no points are found assume standard deviation
+        # TODO change to maximum possible distance from point with noise
+        layers.add('points', points, marker='+', c='r')
+        if result.positions is not None:
+            layers.add('estimates', result.positions.reshape(-1, points.shape[1]), marker='x', c='grey')
+        plot_error_map(points, diff[0], ax2)
+        plot_diff(points, diff[0])
+        figures[f'error_map_{name}'] = fig2
+        figures[f'Deviation3d_{name}'] = plt.gcf()
+    else:
+        ax2.plot(noise_levels, result.level_error())
         ax2.set_ylabel("Average error distance [m]")
         ax2.set_xlabel("Standard deviation [m]")
+        figures[f'noise_relation_{name}'] = fig2
+    layers.draw(ax)
+
+    if save_plots:
+        export_all(figures, save_plots)
+    else:
+        plt.show()
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    experiment = build_experiment(args)
+    plotting = args.show or args.save_plots
+    result = run(experiment, keep_positions=plotting and len(experiment.noise_levels) == 1, workers=args.workers)
+
+    if args.output is not None:
+        (write_npz if args.format == 'npz' else write_csv)(args.output, result)
+    else:
+        for level, error, found in zip(experiment.noise_levels, result.level_error(),
+                                       np.mean(result.found, axis=1) / experiment.trials):
+            print('noise {:8.4f} m  average error {:8.4f} m  found {:6.1%}'.format(level, error, found))
+    if plotting:
+        plot(result, args.layout if args.beacons is None else 'custom', args.save_plots)
 
-else:
-    ax.scatter(b12[0], b12[1])
-    ax.scatter(b22[0], b22[1])
-    ax.scatter(b32[0], b32[1])
-    total_diff_sum = 0
-    total_diff = []
-    for nd in nd_list:
-        diff = []
-        for j in range(len(coordinates)):
-            point = coordinates[j]
-            dist_array = array_to_point_dist([b12, b22, b32], point)
-            if len(nd_list) == 1: ax.scatter(point[0], point[1], marker='+', c='r')
-            diff_sum = 0
-            count = 0
-            for q in range(ex_count):
-                try:
-                    dist_array = noise(dist_array, nd)
-                    pre = trilaterate(b12, b22, b32, dist_array[0], dist_array[1], dist_array[2], variant=3)
-                    diff_sum += distance(pre, point)
-                    count += 1
-                    if len(nd_list) == 1: ax.scatter(pre[0], pre[1], marker='x', c='grey')
-                except ValueError:
-                    count -= 1
-                    # print(f"No solution found for {point}")
-                    continue
-            if count != 0:
-                diff.append(diff_sum / count)
-            else:
-                diff.append(nd)
-        if len(nd_list) == 1: plot_diff(coordinates, diff)
-        total_diff.append(sum(diff) / len(diff))
-    if len(nd_list) > 1:
-        ax2.plot(nd_list, total_diff)
-        ax2.set_ylabel("Average error distance [m]")
-        ax2.set_xlabel("Standard deviation []")
 
-if show_plots:
-    plt.show()
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,76 @@
+"""
+   Least squares multilateration in 2D and 3D with any number of beacons
+
+   Generalisation of trilaterate2d.trilaterate_lstsq. The matrix A of the linearised problem only depends
+   on the beacon layout, so its (weighted) pseudo-inverse is computed once per layout and cached. After that
+   solving a range vector, or thousands of them, is a single matrix multiplication.
+"""
+
+from collections import OrderedDict
+
+import numpy as np
+
+CACHE_SIZE = 64  # number of beacon layouts of which the pseudo-inverse is kept
+
+cache = OrderedDict()
+
+
+class Multilaterator:
+    """Multilaterator(beacons,weights) solves the weighted least squares problem for the point at distance r[i]
+       of beacon i, beacons is an (n,d) array with one beacon per row (d = 2 or 3) and weights an optional
+       (n,) array with a weight per beacon (e.g. 1/variance of the range measurement).
+
+       As in trilaterate_lstsq the problem is made linear by introducing the slack variable q = |x|^2:
+       |x - c_i|^2 = q - 2 c_i^T x + |c_i|^2 = [1 -2c_i^T] [q; x] + |c_i|^2, which should be as close to r_i^2
+       as possible. The rows [1 -2c_i^T] form the matrix A, which should be full rank and well conditioned,
+       so at least d+1 beacons that are not collinear (2D) or coplanar (3D) are needed.
+    """
+
+    def __init__(self, beacons, weights=None):
+        self.beacons = np.array(beacons, dtype=float)
+        nb, self.dim = self.beacons.shape
+        self.weights = np.ones(nb) if weights is None else np.array(weights, dtype=float)
+        if self.weights.shape != (nb,):
+            raise ValueError('There should be one weight per beacon.')
+        if np.any(self.weights < 0):
+            raise ValueError('Weights should not be negative.')
+
+        A = np.hstack((np.ones((nb, 1)), -2 * self.beacons))
+        self.sqrt_w = np.sqrt(self.weights)
+        # rcond as used by np.linalg.lstsq in trilaterate_lstsq
+        self.pinv = np.linalg.pinv(self.sqrt_w[:, None] * A, rcond=1e-10)
+        self.offset = np.sum(self.beacons ** 2, axis=1)  # |c_i|^2
+
+    def solve(self, r):
+        """solve(r) returns the least squares estimate of the point at distances r (n,) of the beacons."""
+        return self.solve_batch(np.reshape(r, (1, -1)))[0]
+
+    def solve_batch(self, ranges):
+        """solve_batch(ranges) returns an (N,d) array with the estimates for all rows of the (N,n) array ranges."""
+        b = (np.asarray(ranges, dtype=float) ** 2 - self.offset) * self.sqrt_w
+        qx = b @ self.pinv.T
+        return qx[:, 1:]
+
+
+def multilaterator(beacons, weights=None):
+    """multilaterator(beacons,weights) returns the Multilaterator for this beacon layout and weights,
+       taken from the cache when it was used before."""
+    beacons = np.asarray(beacons, dtype=float)
+    key = (beacons.shape, beacons.tobytes(), None if weights is None else np.asarray(weights, dtype=float).tobytes())
+    if key in cache:
+        cache.move_to_end(key)
+    else:
+        cache[key] = Multilaterator(beacons, weights)
+        if len(cache) > CACHE_SIZE:
+            cache.popitem(last=False)
+    return cache[key]
+
+
+def multilaterate(beacons, ranges, weights=None):
+    """multilaterate(beacons,ranges,weights) returns the least squares estimate(s) of the point at distances
+       ranges of the beacons (an (n,d) array). ranges is an (n,) array for one point, giving a (d,) result,
+       or an (N,n) array for N points, giving an (N,d) result."""
+    solver = multilaterator(beacons, weights)
+    if np.ndim(ranges) == 1:
+        return solver.solve(ranges)
+    return solver.solve_batch(ranges)
@@ -0,0 +1,114 @@
+"""
+   Noise models for simulated range measurements
+
+   A noise model returns a perturbation array with the shape of the clean ranges, (..., n_beacons), drawn in one
+   call from an explicit np.random.Generator. The clean ranges are never modified, apply returns a new array.
+   The magnitude of every model is multiplied by level, which can be an array that broadcasts with the ranges
+   (e.g. one level per row of a noise sweep). Models can be added: Gaussian(0.05) + NLOSBias(0.1, 0.5).
+"""
+
+import numpy as np
+
+
+class NoiseModel:
+    """Base class of the noise models."""
+
+    def perturbation(self, ranges, rng, level=1.0):
+        """perturbation(ranges,rng,level) returns the array that is added to the clean ranges."""
+        raise NotImplementedError
+
+    def apply(self, ranges, rng, level=1.0):
+        """apply(ranges,rng,level) returns a new array with the noisy ranges."""
+        ranges = np.asarray(ranges, dtype=float)
+        return ranges + self.perturbation(ranges, rng, level)
+
+    def __add__(self, other):
+        return Sum(self, other)
+
+
+class Sum(NoiseModel):
+    """Sum(*models) adds the perturbations of all models."""
+
+    def __init__(self, *models):
+        self.models = models
+
+    def perturbation(self, ranges, rng, level=1.0):
+        return sum(model.perturbation(ranges, rng, level) for model in self.models)
+
+    def __repr__(self):
+        return ' + '.join(repr(model) for model in self.models)
+
+
+class Uniform(NoiseModel):
+    """Uniform(half_width) adds noise uniformly distributed on [-half_width, half_width], as tools.noise."""
+
+    def __init__(self, half_width=1.0):
+        self.half_width = half_width
+
+    def perturbation(self, ranges, rng, level=1.0):
+        return level * self.half_width * rng.uniform(-1, 1, np.shape(ranges))
+
+    def __repr__(self):
+        return f'Uniform({self.half_width!r})'
+
+
+class Gaussian(NoiseModel):
+    """Gaussian(sigma) adds normally distributed noise with standard deviation sigma."""
+
+    def __init__(self, sigma=1.0):
+        self.sigma = sigma
+
+    def perturbation(self, ranges, rng, level=1.0):
+        return level * self.sigma * rng.standard_normal(np.shape(ranges))
+
+    def __repr__(self):
+        return f'Gaussian({self.sigma!r})'
+
+
+class RangeProportional(NoiseModel):
+    """RangeProportional(sigma) adds normally distributed noise with standard deviation sigma * range,
+       e.g. sigma=0.001 for 1 mm per m."""
+
+    def __init__(self, sigma=1.0):
+        self.sigma = sigma
+
+    def perturbation(self, ranges, rng, level=1.0):
+        return level * self.sigma * ranges * rng.standard_normal(np.shape(ranges))
+
+    def __repr__(self):
+        return f'RangeProportional({self.sigma!r})'
+
+
+class NLOSBias(NoiseModel):
+    """NLOSBias(probability,mean) models non line of sight measurements: with the given probability a range is
+       too long by an exponentially distributed (so always positive) bias with the given mean."""
+
+    def __init__(self, probability=0.1, mean=1.0):
+        self.probability = probability
+        self.mean = mean
+
+    def perturbation(self, ranges, rng, level=1.0):
+        shape = np.shape(ranges)
+        blocked = rng.random(shape) < self.probability
+        return np.where(blocked, level * self.mean * rng.standard_exponential(shape), 0.0)
+
+    def __repr__(self):
+        return f'NLOSBias({self.probability!r}, {self.mean!r})'
+
+
+class Outliers(NoiseModel):
+    """Outliers(probability,magnitude) adds a gross error, uniformly distributed on [-magnitude, magnitude], to a
+       fraction probability of the measurements. The error is added to the true range (like every model, so it
+       can be combined with Sum), the measurement is not replaced by an unrelated value."""
+
+    def __init__(self, probability=0.01, magnitude=1.0):
+        self.probability = probability
+        self.magnitude = magnitude
+
+    def perturbation(self, ranges, rng, level=1.0):
+        shape = np.shape(ranges)
+        outlier = rng.random(shape) < self.probability
+        return np.where(outlier, level * self.magnitude * rng.uniform(-1, 1, shape), 0.0)
+
+    def __repr__(self):
+        return f'Outliers({self.probability!r}, {self.magnitude!r})'
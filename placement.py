@@ -0,0 +1,135 @@
+"""
+   Optimisation of beacon positions
+
+   Searches the positions of n beacons inside a workspace polygon (2D, or the polygon times a height range in 3D)
+   that minimise the mean or a percentile of the expected positioning error over the workspace. The search is a
+   multi-start evolution strategy: every start keeps a parent layout and generates offspring by moving the beacons.
+   The expected error is the analytic one of gdop.py. Offspring are first scored on a coarse grid, only the ones
+   that are not clearly worse than their parent are scored on the fine grid. Scoring runs in a process pool.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from gdop import expected_error
+
+
+def in_polygon(points, polygon):
+    """in_polygon(points,polygon) returns True for the (N,2) points inside the polygon, an (M,2) array with the
+       corners in order (ray casting)."""
+    points, polygon = np.asarray(points, dtype=float), np.asarray(polygon, dtype=float)
+    x, y = points[:, 0, None], points[:, 1, None]
+    x1, y1 = polygon[:, 0], polygon[:, 1]
+    x2, y2 = np.roll(x1, -1), np.roll(y1, -1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        crossing = ((y1 > y) != (y2 > y)) & (x < (x2 - x1) * (y - y1) / (y2 - y1) + x1)
+    return np.sum(crossing, axis=1) % 2 == 1
+
+
+def workspace_points(polygon, spacing, heights=None):
+    """workspace_points(polygon,spacing,heights) returns the points of a grid with the given spacing inside the
+       polygon, in 3D the grid also runs over the height range heights = (z_min, z_max)."""
+    polygon = np.asarray(polygon, dtype=float)
+    lower, upper = polygon.min(axis=0), polygon.max(axis=0)
+    axes = [np.arange(lower[i], upper[i] + spacing / 2, spacing) for i in range(2)]
+    if heights is not None:
+        axes.append(np.arange(heights[0], heights[1] + spacing / 2, spacing))
+    points = np.stack(np.meshgrid(*axes, indexing='ij'), axis=-1).reshape(-1, len(axes))
+    return points[in_polygon(points[:, :2], polygon)]
+
+
+def random_layouts(rng, polygon, n_beacons, count, heights=None):
+    """random_layouts(rng,polygon,n_beacons,count,heights) returns count random layouts, a (count,n_beacons,d)
+       array with beacons inside the polygon (and height range)."""
+    polygon = np.asarray(polygon, dtype=float)
+    lower, upper = polygon.min(axis=0), polygon.max(axis=0)
+    positions = np.empty((0, 2))
+    while len(positions) < count * n_beacons:
+        candidates = rng.uniform(lower, upper, (2 * count * n_beacons, 2))
+        positions = np.concatenate((positions, candidates[in_polygon(candidates, polygon)]))
+    positions = positions[:count * n_beacons]
+    if heights is not None:
+        positions = np.hstack((positions, rng.uniform(heights[0], heights[1], (len(positions), 1))))
+    return positions.reshape(count, n_beacons, -1)
+
+
+def layout_score(beacons, points, statistic='mean', penalty=100.0):
+    """layout_score(beacons,points,statistic,penalty) returns the mean (statistic='mean') or a percentile
+       (statistic=90 for the 90th percentile) of the expected error for unit range noise over the points.
+       Points without a position count as an error of penalty."""
+    error = expected_error(beacons, points)
+    error = np.where(np.isfinite(error), np.minimum(error, penalty), penalty)
+    return np.mean(error) if statistic == 'mean' else np.percentile(error, statistic)
+
+
+def score_layouts(task):
+    """score_layouts(task) scores all layouts of task = (layouts, points, statistic), used by the process pool."""
+    layouts, points, statistic = task
+    return np.array([layout_score(beacons, points, statistic) for beacons in layouts])
+
+
+def parallel_scores(pool, layouts, points, statistic, chunks):
+    """parallel_scores(pool,layouts,points,statistic,chunks) scores the layouts in chunks, in the pool when given."""
+    tasks = [(part, points, statistic) for part in np.array_split(layouts, chunks) if len(part)]
+    results = pool.map(score_layouts, tasks) if pool is not None else map(score_layouts, tasks)
+    return np.concatenate(list(results))
+
+
+def optimize_placement(polygon, n_beacons, heights=None, statistic='mean', starts=8, offspring=8, generations=40,
+                       coarse_spacing=None, fine_spacing=None, prune=0.25, seed=None, workers=None):
+    """optimize_placement(polygon,n_beacons,heights,statistic,starts,offspring,generations,coarse_spacing,
+       fine_spacing,prune,seed,workers) searches the best positions of n_beacons (3 or more in 2D, 4 or more in 3D
+       with heights = (z_min, z_max)) inside the workspace polygon.
+       statistic is 'mean' or a percentile (e.g. 90) of the expected error over the workspace. Every generation, each
+       of the starts parents gets offspring children. Children with a coarse grid score more than prune (relative)
+       above their parent are dropped, the others are scored on the fine grid and the best replaces the parent when
+       it is better. The step size grows after a success and shrinks otherwise.
+       The spacings default to 1/10 and 1/40 of the largest polygon size. workers is the number of processes
+       (None uses all cores, 0 scores in this process).
+       Returns the best layout, an (n_beacons,d) array, its fine grid score and the best score per generation."""
+    polygon = np.asarray(polygon, dtype=float)
+    rng = np.random.default_rng(seed)
+    extent = np.max(polygon.max(axis=0) - polygon.min(axis=0))
+    coarse = workspace_points(polygon, coarse_spacing or extent / 10, heights)
+    fine = workspace_points(polygon, fine_spacing or extent / 40, heights)
+
+    pool = ProcessPoolExecutor(max_workers=workers) if workers != 0 else None
+    chunks = 1 if pool is None else (workers or os.cpu_count() or 1)
+    try:
+        parents = random_layouts(rng, polygon, n_beacons, starts, heights)
+        parent_coarse = parallel_scores(pool, parents, coarse, statistic, chunks)
+        parent_fine = parallel_scores(pool, parents, fine, statistic, chunks)
+        step = np.full(starts, extent / 5)
+        history = [parent_fine.min()]
+
+        for _ in range(generations):
+            # move every beacon, beacons that leave the workspace stay at the position of the parent
+            children = parents[:, None] + step[:, None, None, None] * rng.standard_normal(
+                (starts, offspring) + parents.shape[1:])
+            inside = in_polygon(children[..., :2].reshape(-1, 2), polygon).reshape(children.shape[:3])
+            if heights is not None:
+                inside &= (children[..., 2] >= heights[0]) & (children[..., 2] <= heights[1])
+            children = np.where(inside[..., None], children, parents[:, None])
+
+            children_coarse = parallel_scores(pool, children.reshape((-1,) + parents.shape[1:]), coarse, statistic,
+                                              chunks).reshape(starts, offspring)
+            promising = children_coarse <= parent_coarse[:, None] * (1 + prune)
+            children_fine = np.full((starts, offspring), np.inf)
+            if np.any(promising):
+                children_fine[promising] = parallel_scores(pool, children[promising], fine, statistic, chunks)
+
+            best = np.argmin(children_fine, axis=1)
+            best_fine = children_fine[np.arange(starts), best]
+            success = best_fine < parent_fine
+            parents[success] = children[success, best[success]]
+            parent_fine[success] = best_fine[success]
+            parent_coarse[success] = children_coarse[success, best[success]]
+            step = np.where(success, step * 1.5, step * 0.8)
+            history.append(parent_fine.min())
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    winner = np.argmin(parent_fine)
+    return parents[winner], parent_fine[winner], np.array(history)
@@ -5,53 +5,116 @@ Bas Holweg 10-06-2021
 """
 
 
+import os
+
 import numpy as np
 import matplotlib.pyplot as plt
 import trilaterate2d as tr2d
 
 
-def plot_points(points, color='red', size=5):
-    """Plots all points in list"""
-    if np.ndim(points) > 1:
-        if len(points[0]) == 3:
-            ax = plt.axes(projection='3d')
-            for i in range(len(points)):
-                ax.scatter(points[i][0], points[i][1], points[i][2], c=color, s=size)
-        else:
-            for i in range(len(points)):
-                plt.scatter(points[i][0], points[i][1], c=color, s=size)
+def plot_points(points, color='red', size=5, ax=None, **kwargs):
+    """Plots all points in list with one scatter call"""
+    points = np.atleast_2d(np.asarray(points, dtype=float))
+    if points.shape[1] == 3:
+        ax = ax if ax is not None else plt.axes(projection='3d')
+        return ax.scatter(points[:, 0], points[:, 1], points[:, 2], c=color, s=size, **kwargs)
+    else:
+        ax = ax if ax is not None else plt.gca()
+        return ax.scatter(points[:, 0], points[:, 1], c=color, s=size, **kwargs)
+
+
+class Layers:
+    """Collects points per layer (e.g. beacons, grid points, estimates), draw plots every layer with one
+    scatter call instead of one call per point"""
+
+    def __init__(self):
+        self.points = {}
+        self.styles = {}
+
+    def add(self, name, points, **style):
+        """Adds points (one point or an (N,d) array) to layer name, style is passed to scatter"""
+        self.points.setdefault(name, []).append(np.atleast_2d(np.asarray(points, dtype=float)))
+        self.styles.setdefault(name, {}).update(style)
+
+    def draw(self, ax=None):
+        """Draws all layers, 3D points on 3D axes (as plot_points), returns a dict with the PathCollection of every
+        layer"""
+        three_d = any(points[0].shape[1] == 3 for points in self.points.values())
+        if ax is None:
+            ax = plt.axes(projection='3d') if three_d else plt.gca()
+        elif three_d and ax.name != '3d':
+            raise ValueError('3D layers need 3D axes (projection=\'3d\').')
+        collections = {}
+        for name, points in self.points.items():
+            points = np.concatenate(points)
+            if points.shape[1] not in (2, 3):
+                raise ValueError('Layer {!r} has {}D points, only 2D and 3D points can be drawn.'.format(
+                    name, points.shape[1]))
+            collections[name] = ax.scatter(*points.T, label=name, **self.styles[name])
+        return collections
+
+
+def grid_image(points, values):
+    """Returns the x and y coordinates and the (len(y), len(x)) image of values when the 2D points form a regular
+    grid (every combination of x and y exactly once, in any order), else returns None"""
+    points = np.asarray(points, dtype=float)
+    x, xi = np.unique(points[:, 0], return_inverse=True)
+    y, yi = np.unique(points[:, 1], return_inverse=True)
+    if len(x) * len(y) != len(points):
+        return None
+    image = np.full((len(y), len(x)), np.nan)
+    filled = np.zeros((len(y), len(x)), dtype=bool)
+    image[yi, xi] = values
+    filled[yi, xi] = True
+    if not np.all(filled):
+        return None
+    return x, y, image
+
+
+def plot_error_map(points, distarray, ax=None, cmap='inferno'):
+    """Plots the deviation of 2D points as a colour map, with pcolormesh for a regular grid and a triangulated
+    colour map otherwise"""
+    ax = ax if ax is not None else plt.figure().gca()
+    points = np.asarray(points, dtype=float)
+    image = grid_image(points, distarray)
+    if image is not None:
+        mesh = ax.pcolormesh(*image, cmap=cmap, shading='nearest')
     else:
-        if len(points) == 3:
-            ax = plt.axes(projection='3d')
-            ax.scatter(points[0], points[1], points[2], c=color, s=size)
-        else:
-            plt.scatter(points[0], points[1], c=color, s=size)
+        mesh = ax.tripcolor(points[:, 0], points[:, 1], distarray, cmap=cmap)
+    ax.set_aspect('equal')
+    ax.figure.colorbar(mesh, ax=ax, label='Average error distance [m]')
+    return mesh
 
 
 def plot_diff(point, distarray):
     """Plots 3d graph of point coordinates in relation to the deviation"""
-    x, y, z = [], [], []
-    if len(point) > 2:
-        for i in range(len(point)):
-            x.append(point[i][0])
-            y.append(point[i][1])
-            z.append(distarray[i])
-        x, y, z = np.array(x), np.array(y), np.array(z)
-        fig = plt.figure()
-        ax = plt.axes(projection='3d')
-        surf = ax.plot_trisurf(x, y, z, cmap='inferno', linewidth=0.1)
-    else:
-        for i in range(len(point)):
-            x.append(point[0])
-            y.append(point[1])
-            z.append(distarray[i])
-        x, y, z = np.array(x), np.array(y), np.array(z)
-        fig = plt.figure()
-        ax = plt.axes(projection='3d')
-        surf = ax.plot_trisurf(x, y, z, cmap='inferno', linewidth=0.1)
+    point = np.atleast_2d(np.asarray(point, dtype=float))
+    x, y, z = point[:, 0], point[:, 1], np.asarray(distarray, dtype=float)
+    fig = plt.figure()
+    ax = plt.axes(projection='3d')
+    surf = ax.plot_trisurf(x, y, z, cmap='inferno', linewidth=0.1)
     fig.colorbar(surf, shrink=0.5, aspect=5)
 
 
+def headless():
+    """Switches to the non-interactive Agg backend, figures are only written to files"""
+    plt.switch_backend('Agg')
+
+
+def export(fig, name, directory='Plots', dpi=150):
+    """Writes figure fig to directory/name (png when name has no extension) and closes it, returns the path"""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, name if os.path.splitext(name)[1] else name + '.png')
+    fig.savefig(path, dpi=dpi)
+    plt.close(fig)
+    return path
+
+
+def export_all(figures, directory='Plots', dpi=150):
+    """Exports a dict {name: figure} with export, returns the list of paths"""
+    return [export(fig, name, directory, dpi) for name, fig in figures.items()]
+
+
 def visualise_trilat2d(point, a, b, c, a_distances, b_distances, c_distances):
     """Visualises trilateration method for determening point"""
     inter_points = tr2d.circle_intersect(a, b, a_distances[point], b_distances[point])
@@ -0,0 +1,88 @@
+"""
+   Robust positioning with more beacons than needed
+
+   One bad range (e.g. a non line of sight range that is much too long) spoils the fix of the 3 or 4 beacon
+   solvers and of least squares over all beacons. ransac solves every subset of 3 (2D) or 4 (3D) beacons for all
+   points in one vectorized pass, scores every candidate against all ranges and keeps the best consensus per
+   point. Every subset is solved by subtracting the squared range equation of its first beacon from the others,
+   which gives d linear equations in x that are exact for exact ranges (multilaterate.py instead keeps
+   q = |x|^2 as an extra unknown and uses a cached pseudo-inverse). Subsets with collinear (coplanar) beacons are
+   skipped.
+"""
+
+import itertools
+
+import numpy as np
+from geometry import *
+from refine import refine
+
+
+def beacon_subsets(beacons):
+    """beacon_subsets(beacons) returns the (S,d+1) array with the indices of all subsets of d+1 of the (n,d)
+       beacons and a boolean array which is True for the degenerate subsets (collinear in 2D, coplanar in 3D)."""
+    dim = beacons.shape[1]
+    subsets = np.array(list(itertools.combinations(range(len(beacons)), dim + 1)))
+    corners = [beacons[subsets[:, i]] for i in range(dim + 1)]
+    degenerate = is_collinear_batch(*corners) if dim == 2 else is_coplanar_batch(*corners)
+    return subsets, degenerate
+
+
+def subset_solutions(beacons, ranges, subsets):
+    """subset_solutions(beacons,ranges,subsets) returns the (N,S,d) positions for the (N,n) ranges and every
+       (non degenerate) subset of beacons in the (S,d+1) array subsets.
+       |x - c_j|^2 - |x - c_0|^2 = r_j^2 - r_0^2 gives 2 (c_0 - c_j) x = r_j^2 - r_0^2 - |c_j|^2 + |c_0|^2."""
+    c0, cj = beacons[subsets[:, 0]], beacons[subsets[:, 1:]]  # (S,d), (S,d,d)
+    A = 2 * (c0[:, None, :] - cj)
+    r_sq = ranges[:, subsets] ** 2  # (N,S,d+1)
+    b = r_sq[..., 1:] - r_sq[..., :1] - np.sum(cj ** 2, axis=-1) + np.sum(c0 ** 2, axis=-1)[:, None]
+    return (np.linalg.inv(A) @ b[..., None])[..., 0]
+
+
+def ransac(beacons, ranges, threshold=0.1, refit=True):
+    """ransac(beacons,ranges,threshold,refit) estimates the positions for the (N,n) ranges to the (n,d) beacons
+       (n >= 3 in 2D, n >= 4 in 3D, missing ranges are nan).
+       A range is an inlier of a candidate position when its residual |x - c_i| - r_i is at most threshold.
+       The candidate of each point with the lowest cost sum_i min(e_i^2, threshold^2) (MSAC) wins. With refit
+       the winner is refined with refine.refine using only its inliers.
+       Returns the (N,d) positions, the (N,n) inlier mask and the status codes of the points:
+       STATUS_COLLINEAR (2D) or STATUS_COPLANAR (3D) when all subsets are degenerate, STATUS_NO_SOLUTION when no
+       subset has all ranges."""
+    beacons = np.asarray(beacons, dtype=float)
+    ranges = np.atleast_2d(np.asarray(ranges, dtype=float))
+    n, dim = len(ranges), beacons.shape[1]
+    position = np.full((n, dim), np.nan)
+    inliers = np.zeros(ranges.shape, dtype=bool)
+    status = np.full(n, STATUS_OK, dtype=np.int8)
+
+    subsets, degenerate = beacon_subsets(beacons)
+    subsets = subsets[~degenerate]
+    if len(subsets) == 0:
+        status[:] = STATUS_COLLINEAR if dim == 2 else STATUS_COPLANAR
+        return position, inliers, status
+
+    # all candidates of all points, scored against all ranges
+    candidates = subset_solutions(beacons, ranges, subsets)  # (N,S,d)
+    residual = np.abs(np.linalg.norm(candidates[:, :, None, :] - beacons, axis=-1) - ranges[:, None, :])
+    with np.errstate(invalid='ignore'):
+        cost = np.sum(np.minimum(np.nan_to_num(residual, nan=np.inf), threshold) ** 2, axis=-1)
+    cost[np.any(np.isnan(candidates), axis=-1)] = np.inf
+
+    best = np.argmin(cost, axis=1)
+    found = np.isfinite(cost[np.arange(n), best])
+    status[~found] = STATUS_NO_SOLUTION
+    position[found] = candidates[found, best[found]]
+    with np.errstate(invalid='ignore'):
+        inliers[found] = residual[found, best[found]] <= threshold
+
+    if refit:
+        # least squares over the inliers, per group of points with the same inliers
+        enough = found & (np.sum(inliers, axis=1) >= dim + 1)
+        masks, group = np.unique(inliers[enough], axis=0, return_inverse=True)
+        rows = np.flatnonzero(enough)
+        for k, mask in enumerate(masks):
+            members = rows[group.ravel() == k]
+            position[members] = refine(beacons[mask], ranges[members][:, mask], position[members])[0]
+        with np.errstate(invalid='ignore'):
+            inliers[enough] = np.abs(np.linalg.norm(position[enough, None, :] - beacons, axis=-1) -
+                                     ranges[enough]) <= threshold
+    return position, inliers, status
@@ -0,0 +1,90 @@
+"""
+   Iterative (Levenberg-Marquardt) range solver in 2D and 3D
+
+   Minimises the weighted sum of squared range residuals sum_i w_i (|x - c_i| - r_i)^2 for many points at once.
+   Unlike the closed-form solvers in trilaterate2d.py and trilaterate3d.py it always returns an estimate, also
+   when noisy circles or spheres do not intersect. For tracking, start every fix from the previous position of
+   the tag (warm start), a moving tag then typically converges in 1 or 2 iterations.
+"""
+
+import numpy as np
+from multilaterate import multilaterate
+
+
+def range_residuals(beacons, ranges, x):
+    """range_residuals(beacons,ranges,x) returns the residuals e = |x - c_i| - r_i, an (N,n) array, and
+       their Jacobian J = (x - c_i)^T / |x - c_i| with respect to x, an (N,n,d) array, for the (N,d) points x."""
+    diff = x[:, None, :] - beacons  # (N,n,d)
+    dist = np.linalg.norm(diff, axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        J = np.where(dist[..., None] > 0, diff / dist[..., None], 0.0)  # no direction when x is on a beacon
+    return dist - ranges, J
+
+
+def refine(beacons, ranges, x0=None, weights=None, max_iter=20, tol=1e-4):
+    """refine(beacons,ranges,x0,weights,max_iter,tol) estimates the points at distances ranges of the beacons.
+       beacons is an (n,d) array with one beacon per row, ranges an (N,n) array with the ranges of N points and
+       weights an optional (n,) array with a weight per beacon.
+       x0 are the start values, an (N,d) array (e.g. the last positions of the tags), rows that are nan and all
+       rows when x0 is None start from the least squares solution of multilaterate.
+       Iterates until the step is smaller than tol (relative to |x|), the cost decreases less than tol (relative
+       to the cost) or max_iter is reached. Near the solution the error decreases quadratically, so after the
+       last step the error is much smaller than tol.
+       Returns the (N,d) positions, the number of iterations per point, the weighted RMS range residual per point
+       and a boolean array which is True for the points that converged.
+    """
+    beacons = np.asarray(beacons, dtype=float)
+    ranges = np.atleast_2d(np.asarray(ranges, dtype=float))
+    w = np.ones(len(beacons)) if weights is None else np.asarray(weights, dtype=float)
+    if w.shape != (len(beacons),):
+        raise ValueError('There should be one weight per beacon.')
+    if np.any(w < 0) or not np.any(w > 0):
+        raise ValueError('Weights should not be negative and at least one weight should be positive.')
+    n, dim = len(ranges), beacons.shape[1]
+
+    if x0 is None:
+        x = multilaterate(beacons, ranges, weights)
+    else:
+        x = np.array(np.broadcast_to(x0, (n, dim)), dtype=float)
+        missing = np.any(np.isnan(x), axis=1)
+        if np.any(missing):
+            x[missing] = multilaterate(beacons, ranges[missing], weights)
+
+    e, J = range_residuals(beacons, ranges, x)
+    cost = np.sum(w * e ** 2, axis=1)
+    damping = np.full(n, 1e-3)
+    iterations = np.zeros(n, dtype=int)
+    active = np.ones(n, dtype=bool)
+
+    for _ in range(max_iter):
+        idx = np.flatnonzero(active)
+        if idx.size == 0:
+            break
+
+        # damped normal equations (J^T W J + lambda diag(J^T W J)) dx = -J^T W e for all active points
+        JtW = np.swapaxes(J[idx], 1, 2) * w  # (k,d,n)
+        H = JtW @ J[idx]
+        g = JtW @ e[idx][..., None]
+        diag = np.diagonal(H, axis1=1, axis2=2) + 1e-12  # keeps H regular when x is on a beacon
+        H = H + damping[idx, None, None] * (diag[:, :, None] * np.eye(dim))
+        dx = -np.linalg.solve(H, g)[..., 0]
+
+        x_new = x[idx] + dx
+        e_new, J_new = range_residuals(beacons, ranges[idx], x_new)
+        cost_new = np.sum(w * e_new ** 2, axis=1)
+
+        # accept steps that lower the cost and move towards Gauss-Newton, else move towards gradient descent
+        better = cost_new <= cost[idx]
+        small_decrease = better & (cost[idx] - cost_new <= tol * cost[idx])
+        accepted = idx[better]
+        x[accepted], e[accepted], J[accepted], cost[accepted] = x_new[better], e_new[better], J_new[better], \
+            cost_new[better]
+        damping[accepted] /= 10
+        damping[idx[~better]] *= 10
+        iterations[idx] += 1
+
+        step = np.linalg.norm(dx, axis=1)
+        active[idx[small_decrease | (step <= tol * (1 + np.linalg.norm(x[idx], axis=1)))]] = False
+
+    residual = np.sqrt(cost / np.sum(w))
+    return x, iterations, residual, ~active
@@ -0,0 +1,115 @@
+"""
+   Persistent store for Monte Carlo results
+
+   The error and status arrays of an experiment.Experiment are saved as .npy files in a directory named after a
+   hash of the configuration (beacons, points, noise levels, noise model, variant, seed and projection), so a
+   rerun loads them from disk (memory-mapped) instead of simulating again. The number of trials is not part of the key: every
+   trial has its own random stream, spawned from the seed with the trial number, so asking for more trials only
+   simulates the trials that are not stored yet.
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+from experiment import Experiment, ExperimentResult
+from noise_models import Sum
+
+
+def check_noise_repr(noise):
+    """check_noise_repr(noise) raises a ValueError when the repr of the noise model (or of one of the models of a Sum)
+       is the default object repr, which contains the memory address and so changes on every run."""
+    if isinstance(noise, Sum):
+        for model in noise.models:
+            check_noise_repr(model)
+    elif type(noise).__repr__ is object.__repr__:
+        raise ValueError('Noise model {} needs a __repr__ with its parameters to be stored, the default repr changes '
+                         'on every run.'.format(type(noise).__name__))
+
+
+class ResultStore:
+    """ResultStore(root) stores experiment results in the directory root."""
+
+    def __init__(self, root='Results'):
+        self.root = root
+
+    def key(self, experiment):
+        """key(experiment) returns the hash of the configuration of experiment, without the number of trials."""
+        if experiment.seed is None:
+            raise ValueError('Only experiments with a seed can be stored, else the results are not reproducible.')
+        check_noise_repr(experiment.noise)
+        h = hashlib.sha256()
+        for array in (experiment.beacons, experiment.points, experiment.noise_levels):
+            h.update(str(array.shape).encode())
+            h.update(np.ascontiguousarray(array, dtype=float).tobytes())
+        h.update(json.dumps([str(experiment.variant), repr(experiment.noise), str(experiment.seed),
+                             bool(experiment.project)]).encode())
+        return h.hexdigest()[:16]
+
+    def path(self, experiment):
+        """path(experiment) returns the directory in which the results of experiment are stored."""
+        return os.path.join(self.root, self.key(experiment))
+
+    def stored_trials(self, experiment):
+        """stored_trials(experiment) returns the number of trials stored for the configuration of experiment."""
+        try:
+            with open(os.path.join(self.path(experiment), 'spec.json')) as f:
+                return json.load(f)['trials']
+        except FileNotFoundError:
+            return 0
+
+    def load(self, experiment, mmap_mode='r'):
+        """load(experiment,mmap_mode) returns the stored ExperimentResult of experiment, with the first
+           experiment.trials trials, or None when fewer trials are stored. The arrays are memory-mapped."""
+        if self.stored_trials(experiment) < experiment.trials:
+            return None
+        path = self.path(experiment)
+        errors = np.load(os.path.join(path, 'errors.npy'), mmap_mode=mmap_mode)
+        status = np.load(os.path.join(path, 'status.npy'), mmap_mode=mmap_mode)
+        return ExperimentResult(experiment, errors[:, :, :experiment.trials], status[:, :, :experiment.trials])
+
+    def run(self, experiment):
+        """run(experiment) returns the result of experiment, simulating and storing only the trials that are
+           not stored yet."""
+        stored = self.stored_trials(experiment)
+        if stored >= experiment.trials:
+            return self.load(experiment)
+
+        new = simulate_trials(experiment, stored, experiment.trials)
+        if stored:
+            old = self.load(Experiment(experiment.beacons, experiment.points, experiment.noise_levels, stored,
+                                       experiment.variant, experiment.seed, experiment.noise, experiment.project),
+                             mmap_mode=None)
+            errors = np.concatenate((old.errors, new.errors), axis=2)
+            status = np.concatenate((old.status, new.status), axis=2)
+        else:
+            errors, status = new.errors, new.status
+        self.save(experiment, errors, status)
+        return ExperimentResult(experiment, errors, status)
+
+    def save(self, experiment, errors, status):
+        """save(experiment,errors,status) writes the arrays of experiment, the spec is written last so an
+           interrupted save is never loaded."""
+        path = self.path(experiment)
+        os.makedirs(path, exist_ok=True)
+        for name, array in (('errors', errors), ('status', status)):
+            np.save(os.path.join(path, name + '.tmp.npy'), array)
+            os.replace(os.path.join(path, name + '.tmp.npy'), os.path.join(path, name + '.npy'))
+        spec = {'beacons': experiment.beacons.tolist(), 'noise_levels': experiment.noise_levels.tolist(),
+                'points': len(experiment.points), 'trials': errors.shape[2], 'variant': experiment.variant,
+                'noise': repr(experiment.noise), 'seed': experiment.seed, 'project': experiment.project}
+        with open(os.path.join(path, 'spec.json.tmp'), 'w') as f:
+            json.dump(spec, f, indent=1)
+        os.replace(os.path.join(path, 'spec.json.tmp'), os.path.join(path, 'spec.json'))
+
+
+def simulate_trials(experiment, start, stop):
+    """simulate_trials(experiment,start,stop) simulates trials start..stop-1 of experiment. The noise of trial t is
+       drawn from a generator seeded with (seed, t), so a trial gives the same result in every run."""
+    single = Experiment(experiment.beacons, experiment.points, experiment.noise_levels, 1, experiment.variant,
+                        noise=experiment.noise, project=experiment.project)
+    ranges = np.concatenate([single.noisy_ranges(np.random.default_rng(np.random.SeedSequence(experiment.seed,
+                                                                                              spawn_key=(t,))))
+                             for t in range(start, stop)], axis=2)
+    return single.solve_ranges(ranges)
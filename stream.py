@@ -0,0 +1,232 @@
+"""
+   Streaming positioning pipeline
+
+   Range messages {"tag": .., "layout": .., "ranges": [..]} arrive from an asynchronous source (a UDP socket or a
+   replay file of JSON lines), are collected in micro batches per beacon layout and solved with the batch solvers.
+   A batch is solved when it is full or when its oldest message waited flush_interval seconds. The ingest queue is
+   bounded, so a slow consumer slows down the source (backpressure). Per stage latencies are kept in
+   LatencyStats counters with p50/p99. Bad messages (not valid JSON, unknown layout, wrong number of ranges) are
+   dropped and counted, they do not stop the pipeline.
+"""
+
+import asyncio
+import json
+import time
+from collections import deque
+
+import numpy as np
+from experiment import solve
+
+END = None  # marks the end of a source in the queue
+
+
+class LatencyStats:
+    """LatencyStats(size) keeps the last size latency samples (in seconds) of every stage."""
+
+    def __init__(self, size=100000):
+        self.size = size
+        self.samples = {}
+        self.counts = {}
+
+    def add(self, stage, values):
+        """add(stage,values) adds one latency or an array of latencies to stage."""
+        values = np.atleast_1d(values)
+        self.samples.setdefault(stage, deque(maxlen=self.size)).extend(values.tolist())
+        self.counts[stage] = self.counts.get(stage, 0) + len(values)
+
+    def percentile(self, stage, q):
+        """percentile(stage,q) returns the q-th percentile of the latencies of stage."""
+        return float(np.percentile(self.samples[stage], q)) if self.samples.get(stage) else np.nan
+
+    def snapshot(self):
+        """snapshot() returns a dict {stage: {'count': .., 'p50': .., 'p99': ..}} with latencies in seconds."""
+        return {stage: {'count': self.counts[stage], 'p50': self.percentile(stage, 50),
+                        'p99': self.percentile(stage, 99)} for stage in self.samples}
+
+
+def decode(data):
+    """decode(data) returns the dict of a JSON message (str or bytes), or None when data is not a JSON object
+       with the keys tag, layout and ranges."""
+    try:
+        message = json.loads(data)
+    except ValueError:  # includes JSONDecodeError and UnicodeDecodeError
+        return None
+    if not isinstance(message, dict) or not all(key in message for key in ('tag', 'layout', 'ranges')):
+        return None
+    return message
+
+
+def parse_message(data):
+    """parse_message(data) returns (tag, layout, ranges) of a JSON message (str or bytes), or None when data is not
+       a valid message."""
+    message = decode(data)
+    return None if message is None else (message['tag'], message['layout'], message['ranges'])
+
+
+async def replay_source(path, speed=None):
+    """replay_source(path,speed) yields the messages of a JSON lines file, None for lines that are not a valid
+       message. When the messages have a time 't' (in seconds) and speed is given, the messages are paced at speed
+       times real time."""
+    with open(path) as f:
+        start, first = time.perf_counter(), None
+        for line in f:
+            if not line.strip():
+                continue
+            message = decode(line)
+            if message is None:
+                yield None
+                continue
+            if speed and isinstance(message.get('t'), (int, float)):
+                first = message['t'] if first is None else first
+                delay = (message['t'] - first) / speed - (time.perf_counter() - start)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            else:
+                await asyncio.sleep(0)  # let the pipeline run
+            yield message['tag'], message['layout'], message['ranges']
+
+
+class DatagramQueue(asyncio.DatagramProtocol):
+    """Protocol that puts every received datagram in a queue, datagrams are dropped when the queue is full."""
+
+    def __init__(self, queue):
+        self.queue = queue
+        self.dropped = 0
+
+    def datagram_received(self, data, addr):
+        try:
+            self.queue.put_nowait(data)
+        except asyncio.QueueFull:  # UDP has no flow control, so drop instead of blocking the event loop
+            self.dropped += 1
+
+
+async def udp_source(host='127.0.0.1', port=9999, queue_size=10000, stop=b'END'):
+    """udp_source(host,port,queue_size,stop) yields the messages received as JSON datagrams on host:port (None for
+       datagrams that are not a valid message), until a datagram equal to stop is received."""
+    queue = asyncio.Queue(queue_size)
+    transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(lambda: DatagramQueue(queue),
+                                                                             local_addr=(host, port))
+    try:
+        while True:
+            data = await queue.get()
+            if data == stop:
+                break
+            yield parse_message(data)
+    finally:
+        transport.close()
+
+
+class Pipeline:
+    """Pipeline(layouts,variant,batch_size,flush_interval,queue_size) solves range messages in micro batches.
+       layouts is a dict {layout: beacons} with the (n,d) beacon array of every layout, variant is the solver
+       variant of experiment.solve. Latencies are kept in stats (stages queue, batch, solve and total), the number
+       of dropped messages per reason ('malformed', 'unknown_layout', 'bad_ranges') in dropped."""
+
+    def __init__(self, layouts, variant=3, batch_size=256, flush_interval=0.005, queue_size=4096):
+        self.layouts = {}
+        for layout, beacons in layouts.items():
+            beacons = np.asarray(beacons, dtype=float)
+            if beacons.ndim != 2 or beacons.shape[1] not in (2, 3) or len(beacons) <= beacons.shape[1]:
+                raise ValueError('Layout {!r} should be an (n,d) array with d = 2 or 3 and n > d.'.format(layout))
+            if variant not in ('lstsq', 'refine') and beacons.shape not in ((3, 2), (4, 3)):
+                raise ValueError('Layout {!r} needs 3 beacons in 2D or 4 in 3D for variant {!r}, use variant lstsq '
+                                 'or refine.'.format(layout, variant))
+            self.layouts[layout] = beacons
+        self.variant = variant
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue_size = queue_size
+        self.stats = LatencyStats()
+        self.dropped = {}
+
+    def drop(self, reason):
+        """drop(reason) counts a dropped message."""
+        self.dropped[reason] = self.dropped.get(reason, 0) + 1
+
+    async def ingest(self, source, queue):
+        """ingest(source,queue) moves the messages of source to the bounded queue, waits when it is full.
+           Puts END on the queue when source ends or raises, not when ingest is cancelled (run has stopped then)."""
+        try:
+            async for message in source:
+                if message is None:
+                    self.drop('malformed')
+                    continue
+                tag, layout, ranges = message
+                await queue.put((tag, layout, ranges, time.perf_counter()))
+        except Exception:
+            await queue.put(END)  # run raises the error when it awaits this task
+            raise
+        await queue.put(END)
+
+    def accept(self, layout, ranges):
+        """accept(layout,ranges) returns the ranges of a message as an (n,) array, or None (and counts the message
+           as dropped) when the layout is unknown or the ranges do not fit its beacons."""
+        try:
+            beacons = self.layouts.get(layout)
+        except TypeError:  # unhashable layout, e.g. a JSON list
+            beacons = None
+        if beacons is None:
+            self.drop('unknown_layout')
+            return None
+        try:
+            ranges = np.asarray(ranges, dtype=float)
+        except (TypeError, ValueError):  # ragged or not numbers
+            ranges = None
+        if ranges is None or ranges.shape != (len(beacons),):
+            self.drop('bad_ranges')
+            return None
+        return ranges
+
+    def flush(self, layout, batch):
+        """flush(layout,batch) solves a batch of (tag, ranges, received, dequeued) messages of layout and
+           returns (layout, tags, positions, status)."""
+        tags, ranges, received, dequeued = zip(*batch)
+        start = time.perf_counter()
+        position, status = solve(self.layouts[layout], np.array(ranges), self.variant)
+        end = time.perf_counter()
+        self.stats.add('batch', start - np.array(dequeued))
+        self.stats.add('solve', end - start)
+        self.stats.add('total', end - np.array(received))
+        return layout, list(tags), position, status
+
+    async def run(self, source):
+        """run(source) is an async generator that yields (layout, tags, positions, status) for every solved batch
+           of the messages (tag, layout, ranges) of the async iterable source (None for a message that could not be
+           decoded, it is dropped). When the source raises, the pending batches are solved first, then the error is
+           raised."""
+        queue = asyncio.Queue(self.queue_size)
+        reader = asyncio.ensure_future(self.ingest(source, queue))
+        pending, deadlines = {}, {}
+        try:
+            while True:
+                timeout = max(min(deadlines.values()) - time.perf_counter(), 0) if deadlines else None
+                try:
+                    item = await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    item = False  # a deadline passed
+
+                if item is END:
+                    for layout in list(pending):
+                        yield self.flush(layout, pending.pop(layout))
+                    await reader  # raises the error of the source, if it failed
+                    break
+                if item:
+                    tag, layout, ranges, received = item
+                    now = time.perf_counter()
+                    self.stats.add('queue', now - received)
+                    ranges = self.accept(layout, ranges)
+                    if ranges is None:
+                        continue
+                    if layout not in pending:
+                        pending[layout], deadlines[layout] = [], now + self.flush_interval
+                    pending[layout].append((tag, ranges, received, now))
+                    if len(pending[layout]) >= self.batch_size:
+                        del deadlines[layout]
+                        yield self.flush(layout, pending.pop(layout))
+
+                now = time.perf_counter()
+                for layout in [layout for layout, deadline in deadlines.items() if deadline <= now]:
+                    del deadlines[layout]
+                    yield self.flush(layout, pending.pop(layout))
+        finally:
+            reader.cancel()
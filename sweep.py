@@ -0,0 +1,104 @@
+"""
+   Parallel parameter sweeps of Monte Carlo experiments
+
+   The work of a sweep (beacon layouts x noise levels x grid points) is split in chunks of grid points that are
+   solved in a process pool. Every chunk draws its noise from its own generator, spawned from one SeedSequence,
+   and the chunks do not depend on the number of workers, so the results are the same bit for bit for any number
+   of workers. The workers write their results directly in shared memory arrays.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import instrument
+import numpy as np
+from experiment import Experiment, ExperimentResult
+
+
+def shared_array(shape, dtype, name=None):
+    """shared_array(shape,dtype,name) returns a new shared memory block (name is None) or the existing block with
+       this name, together with a numpy array of the given shape and dtype that uses the block as buffer."""
+    size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+    shm = shared_memory.SharedMemory(name=name, create=name is None, size=max(size, 1))
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def run_chunk(task):
+    """run_chunk(task) solves one chunk of a sweep and writes the errors and status codes (and the positions when
+       positions_name is not None) in the shared arrays.
+       Returns the instrumentation snapshot of the chunk when instrumented (for a worker process), else None."""
+    (errors_name, status_name, positions_name, shape, layout, level, start, stop,
+     beacons, points, noise_level, trials, variant, noise, project, seed, profiler, instrumented) = task
+    if instrumented:
+        instrument.reset()
+        instrument.enable()
+    name = 'sweep_chunk_{}_{}_{}'.format(layout, level, start)
+    with profiler(name) if profiler is not None else instrument.profiled(name):
+        result = Experiment(beacons, points, [noise_level], trials, variant, noise=noise, project=project).run(
+            keep_positions=positions_name is not None, rng=np.random.default_rng(seed))
+
+    errors_shm, errors = shared_array(shape, np.float64, errors_name)
+    status_shm, status = shared_array(shape, np.int8, status_name)
+    errors[layout, level, start:stop] = result.errors[0]
+    status[layout, level, start:stop] = result.status[0]
+    del errors, status  # release the buffers before closing
+    errors_shm.close()
+    status_shm.close()
+    if positions_name is not None:
+        positions_shm, positions = shared_array(shape + (points.shape[1],), np.float64, positions_name)
+        positions[layout, level, start:stop] = result.positions[0]
+        del positions
+        positions_shm.close()
+    return instrument.snapshot() if instrumented else None
+
+
+def sweep(layouts, points, noise_levels, trials=20, variant=3, seed=None, chunk_size=1024, workers=None, noise=None,
+          profiler=None, project=False, keep_positions=False):
+    """sweep(layouts,points,noise_levels,trials,variant,seed,chunk_size,workers,noise,profiler,project,keep_positions)
+       runs the Monte Carlo experiment of experiment.Experiment for every beacon layout in layouts (a list of (n,d)
+       arrays of the same shape), noise is the noise model (see noise_models.py), project and keep_positions are
+       as in Experiment and Experiment.run.
+       The points are split in chunks of chunk_size points, every (layout, noise level, chunk) is one task for the
+       process pool with workers processes (None uses all cores, 0 runs all tasks in this process).
+       profiler is a picklable profiler hook (e.g. instrument.CProfileHook) that profiles every chunk, when
+       instrument is enabled the timings and counters of the workers are added to those of this process.
+       Returns a list with an ExperimentResult per layout."""
+    layouts = [np.array(beacons, dtype=float) for beacons in layouts]
+    points = np.array(points, dtype=float)
+    noise_levels = np.atleast_1d(np.array(noise_levels, dtype=float))
+    shape = (len(layouts), len(noise_levels), len(points), int(trials))
+
+    errors_shm, errors = shared_array(shape, np.float64)
+    status_shm, status = shared_array(shape, np.int8)
+    positions_shm, positions = shared_array(shape + (points.shape[1],), np.float64) if keep_positions else (None, None)
+    try:
+        starts = range(0, len(points), chunk_size)
+        seeds = np.random.SeedSequence(seed).spawn(len(layouts) * len(noise_levels) * len(starts))
+        positions_name = positions_shm.name if keep_positions else None
+        tasks = [(errors_shm.name, status_shm.name, positions_name, shape, i, j, start,
+                  min(start + chunk_size, len(points)), layouts[i], points[start:start + chunk_size], noise_levels[j],
+                  trials, variant, noise, project, seeds[(i * len(noise_levels) + j) * len(starts) + k], profiler,
+                  instrument.enabled and workers != 0)
+                 for i in range(len(layouts)) for j in range(len(noise_levels)) for k, start in enumerate(starts)]
+
+        if workers == 0:
+            for task in tasks:
+                run_chunk(task)
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                for snapshot in pool.map(run_chunk, tasks):
+                    if snapshot is not None:
+                        instrument.merge(snapshot)
+
+        errors, status = errors.copy(), status.copy()
+        if keep_positions:
+            positions = positions.copy()
+    finally:
+        for shm in (errors_shm, status_shm, positions_shm):
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+
+    return [ExperimentResult(Experiment(beacons, points, noise_levels, trials, variant, seed, noise, project),
+                             errors[i], status[i], positions[i] if keep_positions else None)
+            for i, beacons in enumerate(layouts)]
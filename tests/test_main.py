@@ -0,0 +1,57 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+import main
+
+BEACONS_3D = ['0,0,0', '10,0,0', '0,10,0', '0,0,10']
+
+
+@pytest.mark.parametrize('argv', [
+    ['--beacons'] + BEACONS_3D,
+    ['--grid', '10', '10', '5'],
+    ['--beacons', '0,0', '10,0', '0,10', '10,10'],
+    ['--beacons', '0,0', '10,0', '--variant', 'lstsq'],
+    ['--beacons', '0,0', '10,0,0', '0,10'],
+    ['--beacons'] + BEACONS_3D + ['--grid', '5', '5', '3', '--save-plots'],
+    ['--grid', '5'],
+    ['--variant', '4'],
+    ['--trials', '0'],
+])
+def test_inputs_that_do_not_fit_give_a_usage_error(argv, capsys):
+    with pytest.raises(SystemExit) as exit_info:
+        main.parse_args(argv)
+    assert exit_info.value.code == 2
+    assert 'error:' in capsys.readouterr().err
+
+
+def test_valid_inputs():
+    main.parse_args(['--beacons', '0,0', '10,0', '0,10', '10,10', '--variant', 'lstsq'])
+    main.parse_args(['--beacons'] + BEACONS_3D + ['--grid', '5', '5', '3'])
+
+
+def test_workers_do_not_change_the_results(tmp_path):
+    argv = ['--experiment', 'map', '--grid', '20', '10', '--seed', '1', '--trials', '3', '--format', 'npz']
+    main.main(argv + ['--output', str(tmp_path / 'a.npz')])
+    main.main(argv + ['--output', str(tmp_path / 'b.npz'), '--workers', '2'])
+    a, b = np.load(tmp_path / 'a.npz'), np.load(tmp_path / 'b.npz')
+    np.testing.assert_array_equal(a['errors'], b['errors'])
+    np.testing.assert_array_equal(a['status'], b['status'])
+
+
+def test_csv_output(tmp_path):
+    main.main(['--grid', '4', '3', '--noise', '0.01', '0.1', '--trials', '2', '--seed', '1',
+               '--output', str(tmp_path / 'r.csv')])
+    table = np.genfromtxt(tmp_path / 'r.csv', delimiter=',', names=True)
+    assert table.dtype.names == ('noise', 'x', 'y', 'mean', 'std', 'rms', 'p95', 'found')
+    assert len(table) == 2 * 5 * 4
+
+
+def test_compute_only_run_does_not_import_matplotlib(tmp_path):
+    code = ('import sys, main; main.main(["--grid", "4", "3", "--trials", "2", "--output", sys.argv[1]]); '
+            'print("matplotlib" in sys.modules)')
+    result = subprocess.run([sys.executable, '-c', code, str(tmp_path / 'r.csv')], capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(main.__file__)), check=True)
+    assert result.stdout.strip() == 'False'
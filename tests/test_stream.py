@@ -0,0 +1,86 @@
+import asyncio
+import json
+
+import numpy as np
+import pytest
+from geometry import STATUS_OK
+from stream import Pipeline, replay_source
+
+LAYOUTS = {'a': [[0., 0.], [30., 0.], [15., 25.]]}
+POINT = np.array([12., 10.])
+RANGES = tuple(np.linalg.norm(np.array(LAYOUTS['a']) - POINT, axis=1))
+
+
+def message(tag, layout='a', ranges=RANGES):
+    return json.dumps({'tag': tag, 'layout': layout, 'ranges': list(ranges)})
+
+
+def collect(pipeline, source):
+    async def run():
+        return [batch async for batch in pipeline.run(source)]
+    return asyncio.run(run())
+
+
+def test_solves_all_messages_in_batches(tmp_path):
+    path = tmp_path / 'replay.jsonl'
+    path.write_text('\n'.join(message(tag) for tag in range(10)))
+    batches = collect(Pipeline(LAYOUTS, batch_size=4), replay_source(str(path)))
+    assert [len(tags) for _, tags, _, _ in batches] == [4, 4, 2]
+    assert sum((tags for _, tags, _, _ in batches), []) == list(range(10))
+    for _, _, position, status in batches:
+        np.testing.assert_allclose(position, np.broadcast_to(POINT, position.shape), atol=1e-9)
+        assert np.all(status == STATUS_OK)
+
+
+def test_bad_messages_are_dropped_and_counted(tmp_path):
+    lines = [message(tag) for tag in range(10)]
+    lines[1] = '{not json'
+    lines[2] = '[1, 2]'
+    lines[3] = message(3, layout='unknown')
+    lines[4] = message(4, layout=['a'])
+    lines[5] = json.dumps({'tag': 5, 'layout': 'a', 'ranges': [1, [2], 3]})
+    lines[6] = message(6, ranges=(1., 2.))
+    path = tmp_path / 'replay.jsonl'
+    path.write_text('\n'.join(lines))
+    pipeline = Pipeline(LAYOUTS, batch_size=4)
+    batches = collect(pipeline, replay_source(str(path)))
+    assert sum((tags for _, tags, _, _ in batches), []) == [0, 7, 8, 9]
+    assert pipeline.dropped == {'malformed': 2, 'unknown_layout': 2, 'bad_ranges': 2}
+
+
+def test_source_error_is_raised_after_the_pending_batch():
+    async def source():
+        yield 1, 'a', [20., 20., 20.]
+        raise OSError('connection lost')
+
+    async def run():
+        batches = []
+        with pytest.raises(OSError, match='connection lost'):
+            async for batch in Pipeline(LAYOUTS, batch_size=4).run(source()):
+                batches.append(batch)
+        return batches
+
+    batches = asyncio.run(run())
+    assert [tags for _, tags, _, _ in batches] == [[1]]
+
+
+def test_closing_run_stops_ingest_with_a_full_queue():
+    async def endless():
+        while True:
+            yield 1, 'a', [20., 20., 20.]
+
+    async def run():
+        results = Pipeline(LAYOUTS, batch_size=4, queue_size=2).run(endless())
+        await results.__anext__()
+        await results.aclose()
+        await asyncio.sleep(0.01)
+        return [task for task in asyncio.all_tasks() if task.get_coro().__name__ == 'ingest' and not task.done()]
+
+    assert asyncio.run(asyncio.wait_for(run(), 5)) == []
+
+
+@pytest.mark.parametrize('layouts,variant', [({'a': [[0., 0.], [1., 1.]]}, 3),
+                                             ({'a': [[0., 0.], [1., 0.], [0., 1.], [1., 1.]]}, 3)])
+def test_layouts_are_checked_at_configuration(layouts, variant):
+    with pytest.raises(ValueError):
+        Pipeline(layouts, variant)
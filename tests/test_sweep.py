@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+from noise_models import Gaussian
+from sweep import sweep
+
+LAYOUTS = [np.array([[15., 15.], [30., 35.], [45., 15.]]), np.array([[15., 20.], [30., 40.], [45., 20.]])]
+POINTS = np.random.default_rng(0).uniform(0, 60, (300, 2))
+LEVELS = [0.05, 0.2]
+
+
+def run(workers, **kwargs):
+    return sweep(LAYOUTS, POINTS, LEVELS, trials=4, seed=7, chunk_size=64, workers=workers, **kwargs)
+
+
+@pytest.mark.parametrize('kwargs', [{}, {'project': True, 'keep_positions': True}, {'noise': Gaussian()}])
+def test_same_results_for_any_number_of_workers(kwargs):
+    in_process, pooled = run(0, **kwargs), run(2, **kwargs)
+    for a, b in zip(in_process, pooled):
+        np.testing.assert_array_equal(a.errors, b.errors)
+        np.testing.assert_array_equal(a.status, b.status)
+        if kwargs.get('keep_positions'):
+            np.testing.assert_array_equal(a.positions, b.positions)
+
+
+def test_kept_positions_give_the_errors():
+    result = run(0, keep_positions=True)[0]
+    assert result.positions.shape == (len(LEVELS), len(POINTS), 4, 2)
+    errors = np.linalg.norm(result.positions - POINTS[None, :, None, :], axis=-1)
+    np.testing.assert_allclose(errors, result.errors)
+
+
+def test_seed_gives_the_same_results():
+    np.testing.assert_array_equal(run(0)[1].errors, run(0)[1].errors)
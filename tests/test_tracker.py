@@ -0,0 +1,51 @@
+import numpy as np
+from tracker import TagFilter
+
+BEACONS = np.array([[0., 0.], [30., 0.], [15., 25.], [0., 25.]])
+
+
+def ranges_of(points):
+    return np.linalg.norm(points[:, None] - BEACONS, axis=-1)
+
+
+def test_uninitialised_tag_with_missing_ranges_is_not_updated():
+    tags = TagFilter(2, 2)
+    ranges = ranges_of(np.array([[10., 10.], [5., 20.]]))
+    ranges[0, 1] = np.nan
+    updated = tags.update_ranges(BEACONS, ranges, 0.1)
+    np.testing.assert_array_equal(updated, [False, True])
+    np.testing.assert_array_equal(tags.initialised, [False, True])
+    np.testing.assert_allclose(tags.position[1], [5., 20.])
+
+
+def test_initial_covariance_follows_the_geometry():
+    tags = TagFilter(1, 2, initial_sigma=10.)
+    tags.update_ranges(BEACONS, ranges_of(np.array([[10., 10.]])), 0.1)
+    covariance = tags.P[0, :2, :2]
+    assert np.all(np.linalg.eigvalsh(covariance) > 0)
+    assert np.trace(covariance) < 0.1  # about sigma^2 per coordinate, not initial_sigma^2
+    np.testing.assert_allclose(tags.P[0, 2:, 2:], 100. * np.eye(2))
+
+
+def test_tracks_moving_tags_with_missing_ranges():
+    rng = np.random.default_rng(0)
+    tags = TagFilter(50, 2, q=0.1)
+    x, v = rng.uniform(5, 25, (50, 2)), rng.normal(0, 1, (50, 2))
+    for _ in range(100):
+        x = x + 0.1 * v
+        tags.predict(0.1)
+        ranges = ranges_of(x) + rng.normal(0, 0.1, (50, 4))
+        ranges[rng.random((50, 4)) < 0.1] = np.nan
+        tags.update_ranges(BEACONS, ranges, 0.1)
+    assert np.all(tags.initialised)
+    assert np.sqrt(np.mean(np.sum((tags.position - x) ** 2, axis=1))) < 0.2
+    assert np.sqrt(np.mean(np.sum((tags.velocity - v) ** 2, axis=1))) < 0.5
+
+
+def test_gate_rejects_outlier_fixes():
+    tags = TagFilter(2, 2, gate=13.8)
+    tags.update_positions(np.array([[10., 10.], [10., 10.]]), 0.1)
+    tags.predict(0.1)
+    updated = tags.update_positions(np.array([[10.05, 10.], [40., 40.]]), 0.1)
+    np.testing.assert_array_equal(updated, [True, False])
+    assert np.linalg.norm(tags.position[1] - [10., 10.]) < 0.1
@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+import trilaterate2d as tr2d
+from geometry import *
+
+BEACONS = np.array([[15., 15.], [30., 35.], [45., 15.]])
+
+
+def noisy_ranges(n=500, noise=0.05, seed=1):
+    rng = np.random.default_rng(seed)
+    points = rng.uniform(0, 60, (n, 2))
+    return np.linalg.norm(points[:, None] - BEACONS, axis=-1) + rng.uniform(-noise, noise, (n, 3))
+
+
+@pytest.mark.parametrize('variant', [1, 3])
+def test_batch_matches_scalar(variant):
+    ranges = noisy_ranges(noise=0.0 if variant == 1 else 0.05)
+    position, status = tr2d.trilaterate_batch(BEACONS, ranges, variant)
+    for row, r in enumerate(ranges):
+        try:
+            expected = tr2d.trilaterate(*BEACONS, *r, variant)
+        except ValueError:
+            assert status[row] != STATUS_OK
+            assert np.all(np.isnan(position[row]))
+        else:
+            assert status[row] == STATUS_OK
+            np.testing.assert_allclose(position[row], expected, atol=1e-7)
+
+
+@pytest.mark.parametrize('variant', [1, 2, 3])
+def test_solve_batch_matches_solve(variant):
+    ranges = noisy_ranges(noise=0.0 if variant == 1 else 0.05)
+    solver = tr2d.Trilaterator2D(BEACONS, variant)
+    position, status = solver.solve_batch(ranges)
+    for row, r in enumerate(ranges):
+        try:
+            expected = solver.solve(*r)
+        except ValueError:
+            assert status[row] != STATUS_OK
+        else:
+            assert status[row] == STATUS_OK
+            np.testing.assert_allclose(position[row], expected, atol=1e-7)
+
+
+@pytest.mark.parametrize('variant', [1, 2, 3])
+def test_projected_flag_matches_status(variant):
+    ranges = noisy_ranges(noise=0.3)
+    solver = tr2d.Trilaterator2D(BEACONS, variant, project=True)
+    position, status = solver.solve_batch(ranges)
+    assert np.all(np.isin(status, (STATUS_OK, STATUS_PROJECTED)))
+    for row, r in enumerate(ranges):
+        point, projected = solver.solve(*r)
+        assert projected == (status[row] == STATUS_PROJECTED)
+        np.testing.assert_allclose(position[row], point, atol=1e-6)
+
+
+def test_collinear_beacons():
+    beacons = np.array([[0., 0.], [1., 0.], [2., 0.]])
+    position, status = tr2d.trilaterate_batch(beacons, noisy_ranges(10))
+    assert np.all(status == STATUS_COLLINEAR)
+    assert np.all(np.isnan(position))
+    with pytest.raises(CollinearError):
+        tr2d.trilaterate(*beacons, 1., 1., 1.)
+
+
+def test_lstsq_returns_x_y():
+    point = np.array([20., 30.])
+    ranges = np.linalg.norm(BEACONS - point, axis=1)
+    np.testing.assert_allclose(tr2d.trilaterate_lstsq(BEACONS.T, ranges).ravel(), point)
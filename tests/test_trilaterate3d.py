@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+import trilaterate3d as tr3d
+from geometry import *
+
+BEACONS = np.array([[15., 15., 0.], [30., 35., 1.], [45., 15., 2.], [30., 20., 10.]])
+
+
+def noisy_ranges(n=500, noise=0.05, seed=1):
+    rng = np.random.default_rng(seed)
+    points = rng.uniform(0, 40, (n, 3))
+    return np.linalg.norm(points[:, None] - BEACONS, axis=-1) + rng.uniform(-noise, noise, (n, 4))
+
+
+@pytest.mark.parametrize('noise', [0.0, 0.05, 0.5])
+def test_batch_matches_scalar(noise):
+    ranges = noisy_ranges(noise=noise)
+    position, status = tr3d.trilaterate_batch(BEACONS, ranges)
+    solver = tr3d.Trilaterator3D(BEACONS)
+    for row, r in enumerate(ranges):
+        try:
+            expected = tr3d.trilaterate(*BEACONS, *r)
+        except ValueError:
+            assert status[row] != STATUS_OK
+            assert np.all(np.isnan(position[row]))
+            with pytest.raises(ValueError):
+                solver.solve(*r)
+        else:
+            assert status[row] == STATUS_OK
+            np.testing.assert_allclose(position[row], expected, atol=1e-6)
+            np.testing.assert_allclose(solver.solve(*r), expected, atol=1e-6)
+
+
+def test_spheres_that_miss_as_a_triple_raise():
+    # pairwise intersecting spheres without a common point
+    c1, c2, c3 = np.array([0., 0., 0.]), np.array([2., 0., 0.]), np.array([1., 1.9, 0.])
+    with pytest.raises(NoIntersectionError):
+        tr3d.sphere_intersections(c1, c2, c3, 1.1, 1.1, 1.1)
+    _, _, status = tr3d.sphere_intersections_batch(c1, c2, c3, np.array([1.1]), np.array([1.1]), np.array([1.1]))
+    assert status[0] == STATUS_NO_INTERSECTION
+
+
+def test_projected_flag_matches_status():
+    ranges = noisy_ranges(noise=0.5)
+    solver = tr3d.Trilaterator3D(BEACONS, project=True)
+    position, status = solver.solve_batch(ranges)
+    for row, r in enumerate(ranges):
+        point, projected = solver.solve(*r)
+        assert projected == (status[row] == STATUS_PROJECTED)
+        np.testing.assert_allclose(position[row], point, atol=1e-6)
+
+
+def test_coplanar_beacons():
+    beacons = BEACONS.copy()
+    beacons[:, 2] = 0.
+    position, status = tr3d.trilaterate_batch(beacons, noisy_ranges(10))
+    assert np.all(status == STATUS_COPLANAR)
+    assert np.all(np.isnan(position))
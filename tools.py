@@ -10,10 +10,9 @@ import geometry as g
 
 
 def noise(array, nd=0.0):
-    """Adds noice with standard deviation of nd to given array"""
-    for i in range(len(array)):
-        array[i] += nd * np.random.uniform(-1, 1)
-    return array
+    """Returns a copy of array with added noise of nd * uniform(-1, 1), the given array is not changed.
+    See noise_models.py for other noise models and reproducible noise"""
+    return np.asarray(array, dtype=float) + nd * np.random.uniform(-1, 1, np.shape(array))
 
 
 def create_grid(x_size=10, y_size=10, z_size=None):
@@ -29,6 +28,22 @@ def create_grid(x_size=10, y_size=10, z_size=None):
     return np.array(c)
 
 
+def grid_shape(x_size=10, y_size=10, z_size=None):
+    """Returns the shape of the grid of create_grid, (x_size+1, y_size+1) or (x_size+1, y_size+1, z_size)"""
+    return (x_size + 1, y_size + 1, z_size) if z_size else (x_size + 1, y_size + 1)
+
+
+def iter_grid(x_size=10, y_size=10, z_size=None, chunk_size=65536, spacing=1.0):
+    """Yields the point coordinates of create_grid in (chunk_size, d) blocks (the last block can be smaller),
+    without building the whole grid. The coordinates are multiplied by spacing, e.g. 0.01 for a grid in cm
+    when the sizes are given in cm"""
+    shape = grid_shape(x_size, y_size, z_size)
+    n = int(np.prod(shape))
+    for start in range(0, n, chunk_size):
+        index = np.unravel_index(np.arange(start, min(start + chunk_size, n)), shape)
+        yield spacing * np.stack(index, axis=-1)
+
+
 def point_array_diff(a1, a2):
     """Returns an array with distance differenses between all points with the same index"""
     if len(a1) != len(a2):
@@ -0,0 +1,171 @@
+"""
+   Kalman filter bank for tracking many tags at once
+
+   The states of all tags are kept in stacked arrays: x, an (T,m) array with per tag the position, the velocity
+   and (for order=2) the acceleration, and P, the (T,m,m) covariances. predict and the updates are one vectorized
+   step for all tags. Measurements are either position fixes of the solvers (nan rows, e.g. where a circle
+   intersection failed, are skipped so the tag coasts on its prediction) or the raw ranges to the beacons, with
+   an extended Kalman filter update in which missing ranges (nan) are left out.
+"""
+
+import math
+
+import numpy as np
+from gdop import covariance
+from multilaterate import multilaterate
+
+
+def transition(dt, dim, order=1):
+    """transition(dt,dim,order) returns the (m,m) state transition matrix for the time step dt, or the (T,m,m)
+       matrices when dt is an (T,) array, of a constant velocity (order=1) or constant acceleration (order=2) model."""
+    dt = np.asarray(dt, dtype=float)
+    block = np.zeros(dt.shape + (order + 1, order + 1))
+    for i in range(order + 1):
+        for j in range(i, order + 1):
+            block[..., i, j] = dt ** (j - i) / math.factorial(j - i)
+    return np.kron(block, np.eye(dim))
+
+
+def process_noise(dt, dim, order=1, q=1.0):
+    """process_noise(dt,dim,order,q) returns the (m,m) or (T,m,m) process noise covariances for the time steps dt,
+       for a white noise derivative of the highest state (acceleration for order=1, jerk for order=2) with
+       spectral density q."""
+    dt = np.asarray(dt, dtype=float)
+    block = np.zeros(dt.shape + (order + 1, order + 1))
+    for i in range(order + 1):
+        for j in range(order + 1):
+            power = 2 * order + 1 - i - j
+            block[..., i, j] = q * dt ** power / (math.factorial(order - i) * math.factorial(order - j) * power)
+    return np.kron(block, np.eye(dim))
+
+
+def joseph_update(P, K, H, R):
+    """joseph_update(P,K,H,R) returns the updated covariances (I - K H) P (I - K H)^T + K R K^T, which stay
+       symmetric and positive definite with rounding errors (unlike P - K H P)."""
+    A = np.eye(P.shape[-1]) - K @ H
+    P = A @ P @ np.swapaxes(A, -1, -2) + K @ R @ np.swapaxes(K, -1, -2)
+    return (P + np.swapaxes(P, -1, -2)) / 2
+
+
+class TagFilter:
+    """TagFilter(n_tags,dim,order,q,initial_sigma,gate) tracks n_tags tags in 2D or 3D with a constant velocity
+       (order=1) or constant acceleration (order=2) model with process noise density q.
+       Tags start uninitialised (nan state), the first measurement sets the position, the velocity (and
+       acceleration) start at 0 with standard deviation initial_sigma. With gate, position fixes with a squared
+       Mahalanobis distance to the prediction above gate (e.g. 13.8 = 99.9% in 2D) are rejected as outliers."""
+
+    def __init__(self, n_tags, dim, order=1, q=1.0, initial_sigma=10.0, gate=None):
+        self.dim, self.order, self.q = dim, order, q
+        self.initial_sigma = initial_sigma
+        self.gate = gate
+        self.m = dim * (order + 1)
+        self.x = np.full((n_tags, self.m), np.nan)
+        self.P = np.tile(np.eye(self.m) * initial_sigma ** 2, (n_tags, 1, 1))
+
+    @property
+    def initialised(self):
+        """initialised is True for the tags that have had a measurement."""
+        return ~np.isnan(self.x[:, 0])
+
+    @property
+    def position(self):
+        """position is the (T,d) array with the estimated positions, nan for uninitialised tags."""
+        return self.x[:, :self.dim]
+
+    @property
+    def velocity(self):
+        """velocity is the (T,d) array with the estimated velocities."""
+        return self.x[:, self.dim:2 * self.dim]
+
+    def initialise(self, tags, positions, sigma=None, position_covariance=None):
+        """initialise(tags,positions,sigma,position_covariance) sets the state of tags to positions at rest, with
+           position standard deviation sigma (a number or an array with a value per tag) or the (k,d,d) position
+           covariances position_covariance."""
+        self.x[tags] = 0.0
+        self.x[tags, :self.dim] = positions
+        P = np.tile(np.eye(self.m) * self.initial_sigma ** 2, (len(positions), 1, 1))
+        if position_covariance is None:
+            position_covariance = np.asarray(sigma, dtype=float)[..., None, None] ** 2 * np.eye(self.dim)
+        P[:, :self.dim, :self.dim] = position_covariance
+        self.P[tags] = P
+
+    def predict(self, dt):
+        """predict(dt) advances all tags by the time step dt, a number or an (T,) array (0 leaves a tag as is)."""
+        F = transition(dt, self.dim, self.order)
+        if F.ndim == 2:  # one time step for all tags
+            self.x = self.x @ F.T
+        else:
+            self.x = (F @ self.x[..., None])[..., 0]
+        self.P = F @ self.P @ np.swapaxes(F, -1, -2) + process_noise(dt, self.dim, self.order, self.q)
+
+    def update_positions(self, positions, sigma):
+        """update_positions(positions,sigma) updates all tags with position fixes, an (T,d) array in which nan rows
+           are missing fixes, with standard deviation sigma per coordinate (a number or an (T,) array).
+           Returns a boolean array which is True for the tags that were updated."""
+        positions = np.asarray(positions, dtype=float)
+        sigma = np.broadcast_to(np.asarray(sigma, dtype=float), (len(self.x),))
+        valid = np.all(np.isfinite(positions), axis=1)
+        new = valid & ~self.initialised
+        if np.any(new):
+            self.initialise(new, positions[new], sigma[new])
+        idx = np.flatnonzero(valid & ~new)
+        if idx.size == 0:
+            return valid
+
+        # linear update, H selects the position from the state
+        d = self.dim
+        P = self.P[idx]
+        innovation = positions[idx] - self.x[idx, :d]
+        S = P[:, :d, :d] + sigma[idx, None, None] ** 2 * np.eye(d)
+        S_inv = np.linalg.inv(S)
+        if self.gate is not None:
+            distance = (innovation[:, None, :] @ S_inv @ innovation[..., None])[:, 0, 0]
+            keep = distance <= self.gate
+            valid[idx[~keep]] = False
+            idx, P, innovation, S_inv = idx[keep], P[keep], innovation[keep], S_inv[keep]
+        K = P[:, :, :d] @ S_inv  # (k,m,d)
+        self.x[idx] += (K @ innovation[..., None])[..., 0]
+        H = np.eye(d, self.m)
+        self.P[idx] = joseph_update(P, K, H, sigma[idx, None, None] ** 2 * np.eye(d))
+        return valid
+
+    def update_ranges(self, beacons, ranges, sigma):
+        """update_ranges(beacons,ranges,sigma) updates all tags with their ranges to the (n,d) beacons, an (T,n)
+           array in which nan ranges are missing, with range standard deviation sigma (extended Kalman filter).
+           Uninitialised tags with all ranges start at the least squares solution of multilaterate, with the
+           position covariance of the beacon geometry in that point (gdop.covariance, initial_sigma where the
+           geometry gives no position). Uninitialised tags with missing ranges stay uninitialised.
+           Returns a boolean array which is True for the tags that were updated or initialised."""
+        beacons = np.asarray(beacons, dtype=float)
+        ranges = np.asarray(ranges, dtype=float)
+        measured = np.isfinite(ranges)
+        initialised = self.initialised
+        new = np.all(measured, axis=1) & ~initialised
+        if np.any(new):
+            positions = multilaterate(beacons, ranges[new])
+            position_covariance = covariance(beacons, positions, sigma)
+            degenerate = ~np.all(np.isfinite(position_covariance), axis=(1, 2))
+            position_covariance[degenerate] = self.initial_sigma ** 2 * np.eye(self.dim)
+            self.initialise(new, positions, position_covariance=position_covariance)
+        valid = np.any(measured, axis=1) & initialised
+        idx = np.flatnonzero(valid)
+        if idx.size == 0:
+            return valid | new
+
+        # linearise the ranges around the prediction, missing ranges get a zero row in H and no innovation
+        d = self.dim
+        P = self.P[idx]
+        diff = self.x[idx, None, :d] - beacons  # (k,n,d)
+        dist = np.linalg.norm(diff, axis=-1)
+        mask = measured[idx]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            J = np.where((mask & (dist > 0))[..., None], diff / dist[..., None], 0.0)
+        innovation = np.where(mask, ranges[idx] - dist, 0.0)
+
+        PHt = P[:, :, :d] @ np.swapaxes(J, 1, 2)  # (k,m,n)
+        S = J @ PHt[:, :d, :] + sigma ** 2 * np.eye(len(beacons))
+        K = PHt @ np.linalg.inv(S)
+        self.x[idx] += (K @ innovation[..., None])[..., 0]
+        H = np.concatenate((J, np.zeros(J.shape[:2] + (self.m - d,))), axis=2)
+        self.P[idx] = joseph_update(P, K, H, sigma ** 2 * np.eye(len(beacons)))
+        return valid | new
@@ -10,8 +10,11 @@
    Rufus Fraanje, GNU-GPLv3, 2021/05/01
 """
 
+import math
 import numpy as np
+import instrument
 from geometry import *
+from multilaterate import multilaterate
 
 
 def is_on_circle(c, r, p):
@@ -20,20 +23,34 @@ def is_on_circle(c, r, p):
 
 
 def perpendicular(p):
-    """perpendicular(p) returns the vector that is 90^o rotation of p, and thus perpendicular to p"""
-    return np.array([-p[1], p[0]])
+    """perpendicular(p) returns the vector that is 90^o rotation of p, and thus perpendicular to p,
+       p can also be an (N,2) array of vectors"""
+    p = np.asarray(p)
+    return np.stack((-p[..., 1], p[..., 0]), axis=-1)
 
 
-def circle_intersect(c1, c2, r1, r2):
+def closest_approach(d, r1, r2):
+    """closest_approach(d,r1,r2) returns alpha such that c1 + alpha * (c2 - c1) is the midpoint between the closest
+       points of two circles that do not intersect, with d the distance between the centers (d > 0).
+       The closest points are on the line through the centers, also when one circle lies inside the other."""
+    return np.where(r1 - r2 > d, d + r1 + r2, np.where(r2 - r1 > d, d - r1 - r2, d + r1 - r2)) / (2 * d)
+
+
+def circle_intersect(c1, c2, r1, r2, project=False):
     """circle_intersect(c1,c2,r1,r2) returns the intersection points of two circles
        one with center c1 and radius r1 and the
-       other with center c2 and radius r2."""
+       other with center c2 and radius r2.
+       With project=True circles that miss each other give twice the closest approach point (see
+       closest_approach) instead of a ValueError, and a third value that is True when the point was projected."""
 
     d = distance(c1, c2)
     if np.isclose(d, 0) and np.isclose(r1, r2):  # degenerate situation: circles overlap
-        raise ValueError('Both circles are equal.')
+        raise CoincidentError('Both circles are equal.')
     if d > r1 + r2 or d < np.abs(r1 - r2):  # degenerate situation: no intersections
-        raise ValueError('There are no intersection points.')
+        if not project or np.isclose(d, 0):  # concentric circles have no closest approach direction
+            raise NoIntersectionError('There are no intersection points.')
+        p = c1 + closest_approach(d, r1, r2) * (c2 - c1)
+        return p, p, True
 
     # in following situation with one solution (beta=0) will return two equal solutions
     alpha = ((r1 / d) ** 2 - (r2 / d) ** 2 + 1) / 2
@@ -45,9 +62,47 @@ def circle_intersect(c1, c2, r1, r2):
     p1 = c1 + alpha * v1 + beta * v2
     p2 = c1 + alpha * v1 - beta * v2
 
-    return p1, p2
+    return (p1, p2, False) if project else (p1, p2)
+
+
+def circle_intersect_batch(c1, c2, r1, r2, project=False):
+    """circle_intersect_batch(c1,c2,r1,r2,project) is the array version of circle_intersect.
+       The centers c1 and c2 have shape (2,) or (N,2), the radii r1 and r2 have shape (N,).
+       Returns the intersection points p1, p2 as (N,2) arrays and an (N,) array with status codes,
+       instead of raising ValueError. Rows without intersection points are set to nan, with project=True
+       they get the closest approach point and STATUS_PROJECTED."""
+    c1, c2 = np.asarray(c1, dtype=float), np.asarray(c2, dtype=float)
+    v1 = c2 - c1
+    return circle_intersect_frame(c1, v1, perpendicular(v1), np.linalg.norm(v1, axis=-1), r1, r2, project)
+
+
+def circle_intersect_frame(c1, v1, v2, d, r1, r2, project=False):
+    """circle_intersect_frame(c1,v1,v2,d,r1,r2,project) does the radius dependent part of circle_intersect_batch,
+       with v1 = c2 - c1, its perpendicular v2 and the distance d between the centers."""
+    d, r1, r2 = np.broadcast_arrays(d, np.asarray(r1, dtype=float), np.asarray(r2, dtype=float))
+
+    status = np.full(d.shape, STATUS_OK, dtype=np.int8)
+    status[(d > r1 + r2) | (d < np.abs(r1 - r2))] = STATUS_NO_INTERSECTION
+    status[np.isclose(d, 0) & np.isclose(r1, r2)] = STATUS_COINCIDENT
 
+    with np.errstate(divide='ignore', invalid='ignore'):
+        alpha = ((r1 / d) ** 2 - (r2 / d) ** 2 + 1) / 2
+        # clip rounding errors for touching circles, these give two equal solutions
+        beta = np.sqrt(np.maximum((r1 / d) ** 2 - alpha ** 2, 0))
+        if project:  # beta is already 0 for circles that miss each other
+            projected = (status == STATUS_NO_INTERSECTION) & (d > 0)
+            alpha = np.where(projected, closest_approach(d, r1, r2), alpha)
+            status[projected] = STATUS_PROJECTED
+    p1 = c1 + alpha[:, None] * v1 + beta[:, None] * v2
+    p2 = c1 + alpha[:, None] * v1 - beta[:, None] * v2
+    failed = (status != STATUS_OK) & (status != STATUS_PROJECTED)
+    p1[failed] = np.nan
+    p2[failed] = np.nan
 
+    return p1, p2, status
+
+
+@instrument.counts_outcomes(3)
 def trilaterate(c1, c2, c3, r1, r2, r3, variant=1):
     """trilaterate(c1,c2,c3,r1,r2,r3) returns the point (if it exists) 
        that is at distance r1 to c1, r2 to c2 and r3 to c3.
@@ -57,25 +112,32 @@ def trilaterate(c1, c2, c3, r1, r2, r3, variant=1):
               =2: tries other combinations of circles and returns the solution closest to the other circle
               =3: computes all pairs of solutions, selects the 3 closest variants in the pairs and returns
                   their average (computationally most complex but expected to be the most accurate solution).
+       Raises a TrilaterationError (a ValueError) of which the class gives the reason of the failure.
     """
+    started = instrument.start()
     if is_equal(c1, c2) or is_equal(c1, c3) or is_equal(c2, c3):
-        raise ValueError('All beacons should be at different loca   tions, at least two have same location.')
+        raise CoincidentBeaconsError(
+            'All beacons should be at different loca   tions, at least two have same location.')
 
     # check whether c1,c2,c3 are on a straight line
     if is_collinear(c1, c2, c3):
-        raise ValueError('c1, c2 and c3 are collinear, but should form a real triangle.')
+        raise CollinearError('c1, c2 and c3 are collinear, but should form a real triangle.')
+    started = instrument.stop('trilaterate2d.validation', started)
 
     if variant == 1:
         # Variant 1:
         c_other, r_other = c3, r3
         p = circle_intersect(c1, c2, r1, r2)
+        started = instrument.stop('trilaterate2d.intersection', started)
 
         if is_on_circle(c_other, r_other, p[0]):
-            return p[0]
+            point = p[0]
         elif is_on_circle(c_other, r_other, p[1]):
-            return p[1]
+            point = p[1]
         else:
-            raise ValueError('No solution found.')
+            raise NoSolutionError('No solution found.')
+        instrument.stop('trilaterate2d.disambiguation', started)
+        return point
     elif variant == 2:
         # Variant 2:
         c_other, r_other = c3, r3
@@ -87,12 +149,15 @@ def trilaterate(c1, c2, c3, r1, r2, r3, variant=1):
                 c_other, r_other = c1, r1
                 p = circle_intersect(c2, c3, r2, r3)
                 if p is None:
-                    raise ValueError('No solution found.')
+                    raise NoSolutionError('No solution found.')
+        started = instrument.stop('trilaterate2d.intersection', started)
 
         if np.abs(distance(p[0], c_other) - r_other) < np.abs(distance(p[1], c_other) - r_other):
-            return p[0]
+            point = p[0]
         else:
-            return p[1]
+            point = p[1]
+        instrument.stop('trilaterate2d.disambiguation', started)
+        return point
 
     else:
         # Variant 3:
@@ -102,9 +167,181 @@ def trilaterate(c1, c2, c3, r1, r2, r3, variant=1):
             sol23 = circle_intersect(c2, c3, r2, r3)
         except ValueError as e:
             raise e
+        started = instrument.stop('trilaterate2d.intersection', started)
 
         indices = nearest_points(sol12, sol13, sol23)
-        return (sol12[indices[0]] + sol13[indices[1]] + sol23[indices[2]]) / 3
+        started = instrument.stop('trilaterate2d.disambiguation', started)
+        point = (sol12[indices[0]] + sol13[indices[1]] + sol23[indices[2]]) / 3
+        instrument.stop('trilaterate2d.averaging', started)
+        return point
+
+
+def trilaterate_batch(beacons, ranges, variant=1, project=False):
+    """trilaterate_batch(beacons,ranges,variant,project) is the array version of trilaterate.
+       beacons is a (3,2) array with the circle centers c1, c2, c3 and ranges an (N,3) array,
+       every row holds the radii r1, r2, r3 of one point. The variants are the same as in trilaterate,
+       but variant 2 really falls back to circles 1,3 and 2,3 for the rows where circles 1,2 do not intersect.
+       Returns an (N,2) array with positions and an (N,) array with status codes (STATUS_OK when found),
+       positions of rows without solution are nan. With project=True near misses give an estimate with
+       STATUS_PROJECTED instead, see Trilaterator2D.
+    """
+    c1, c2, c3 = np.asarray(beacons, dtype=float)
+    if is_collinear(c1, c2, c3):  # also True when at least two beacons have the same location
+        n = len(np.atleast_2d(ranges))
+        status = np.full(n, STATUS_COLLINEAR, dtype=np.int8)
+        instrument.count_status(beacons, status)
+        return np.full((n, 2), np.nan), status
+
+    return Trilaterator2D(beacons, variant, project).solve_batch(ranges)
+
+
+class Trilaterator2D:
+    """Trilaterator2D(beacons,variant,project) solves trilateration problems for a fixed triangle of beacons,
+       beacons is a (3,2) array with the circle centers c1, c2, c3. The beacons are checked and all vectors
+       that only depend on the beacons are computed once, so solve and solve_batch only do the arithmetic
+       that depends on the ranges. The variants are the same as in trilaterate_batch.
+       With project=True noisy ranges always give an estimate: circles that miss each other give their closest
+       approach point, variant 1 takes the intersection closest to circle 3 when none is on it and variant 2
+       uses the closest approach of circles 1,2 when no pair intersects. solve_batch marks these rows with
+       STATUS_PROJECTED.
+    """
+
+    # circle pairs (i, j) and the index of the remaining circle, in the order used by trilaterate
+    pairs = ((0, 1, 2), (0, 2, 1), (1, 2, 0))
+
+    def __init__(self, beacons, variant=1, project=False):
+        started = instrument.start()
+        self.beacons = np.array(beacons, dtype=float)
+        self.variant = variant
+        self.project = project
+        c1, c2, c3 = self.beacons
+        if is_equal(c1, c2) or is_equal(c1, c3) or is_equal(c2, c3):
+            raise CoincidentBeaconsError(
+                'All beacons should be at different locations, at least two have same location.')
+        if is_collinear(c1, c2, c3):
+            raise CollinearError('c1, c2 and c3 are collinear, but should form a real triangle.')
+
+        # per circle pair: center, v1 = c_j - c_i, its perpendicular v2 and the distance between the centers
+        self.frames = []
+        for i, j, _ in self.pairs:
+            v1 = self.beacons[j] - self.beacons[i]
+            self.frames.append((self.beacons[i], v1, perpendicular(v1), np.linalg.norm(v1)))
+        # the same as plain floats for the single point solver
+        self.centers = [tuple(float(x) for x in c) for c in self.beacons]
+        self.scalar_frames = [(float(c[0]), float(c[1]), float(v1[0]), float(v1[1]), float(d))
+                              for c, v1, _, d in self.frames]
+        instrument.stop('trilaterate2d.batch.validation', started)
+
+    def intersect(self, k, ra, rb, project=False):
+        """intersect(k,ra,rb,project) returns the two intersection points of circle pair k as tuples,
+           raises ValueError when the circles do not intersect, or with project returns the closest
+           approach point twice and a third value that is True when the point was projected (as circle_intersect)."""
+        cx, cy, vx, vy, d = self.scalar_frames[k]
+        projected = d > ra + rb or d < abs(ra - rb)
+        if projected:
+            if not project:
+                raise NoIntersectionError('There are no intersection points.')
+            alpha, beta = float(closest_approach(d, ra, rb)), 0.0
+        else:
+            alpha = ((ra / d) ** 2 - (rb / d) ** 2 + 1) / 2
+            beta = math.sqrt(max((ra / d) ** 2 - alpha ** 2, 0.0))
+        x, y = cx + alpha * vx, cy + alpha * vy
+        p1, p2 = (x - beta * vy, y + beta * vx), (x + beta * vy, y - beta * vx)
+        return (p1, p2, projected) if project else (p1, p2)
+
+    def solve(self, r1, r2, r3):
+        """solve(r1,r2,r3) returns the point at distance r1, r2 and r3 of the beacons,
+           raises ValueError when no solution is found. With project it returns the point and a flag that is True
+           when the point is a projected estimate (STATUS_PROJECTED in solve_batch)."""
+        r = (float(r1), float(r2), float(r3))
+
+        if self.variant == 1:
+            c_other, r_other = self.centers[2], r[2]
+            p = self.intersect(0, r[0], r[1], self.project)
+            for q in p[:2]:
+                if abs(math.dist(c_other, q) - r_other) <= 1e-8 + 1e-5 * abs(r_other):  # as np.isclose
+                    return (np.array(q), p[2]) if self.project else np.array(q)
+            if self.project:
+                return np.array(min(p[:2], key=lambda q: abs(math.dist(c_other, q) - r_other))), True
+            raise NoSolutionError('No solution found.')
+        elif self.variant == 2:
+            for k, (i, j, other) in enumerate(self.pairs):
+                try:
+                    p = self.intersect(k, r[i], r[j])
+                except ValueError:
+                    continue
+                c_other, r_other = self.centers[other], r[other]
+                if abs(math.dist(p[0], c_other) - r_other) < abs(math.dist(p[1], c_other) - r_other):
+                    q = np.array(p[0])
+                else:
+                    q = np.array(p[1])
+                return (q, False) if self.project else q
+            if self.project:
+                return np.array(self.intersect(0, r[0], r[1], True)[0]), True
+            raise NoSolutionError('No solution found.')
+        else:
+            sols = [self.intersect(k, r[i], r[j], self.project) for k, (i, j, _) in enumerate(self.pairs)]
+            point = np.array(nearest_points_mean(*[sol[:2] for sol in sols]))
+            return (point, any(sol[2] for sol in sols)) if self.project else point
+
+    def solve_batch(self, ranges):
+        """solve_batch(ranges) solves all rows r1, r2, r3 of the (N,3) array ranges, returns an (N,2) array
+           with positions and an (N,) array with status codes, positions without solution are nan."""
+        r = np.atleast_2d(np.asarray(ranges, dtype=float)).T
+        started = instrument.start()
+
+        if self.variant == 1:
+            p1, p2, status = circle_intersect_frame(*self.frames[0], r[0], r[1], project=self.project)
+            started = instrument.stop('trilaterate2d.batch.intersection', started)
+            c3, r3 = self.beacons[2], r[2]
+            d1, d2 = np.linalg.norm(p1 - c3, axis=-1), np.linalg.norm(p2 - c3, axis=-1)
+            on_circle1 = np.isclose(d1, r3)
+            on_circle2 = np.isclose(d2, r3)
+            missed = (status == STATUS_OK) & ~on_circle1 & ~on_circle2
+            if self.project:  # take the intersection closest to circle 3
+                closer2 = np.abs(d2 - r3) < np.abs(d1 - r3)
+                position = select_points((p1, p2), ~on_circle1 & (on_circle2 | closer2))
+                status[missed] = STATUS_PROJECTED
+            else:
+                position = select_points((p1, p2), ~on_circle1)
+                status[missed] = STATUS_NO_SOLUTION
+            instrument.stop('trilaterate2d.batch.disambiguation', started)
+        elif self.variant == 2:
+            c_other, r_other = np.tile(self.beacons[2], (r.shape[1], 1)), r[2].copy()
+            p1, p2, status = circle_intersect_frame(*self.frames[0], r[0], r[1])
+            for k in (1, 2):
+                i, j, other = self.pairs[k]
+                retry = status != STATUS_OK
+                q1, q2, q_status = circle_intersect_frame(*self.frames[k], r[i][retry], r[j][retry])
+                p1[retry], p2[retry], status[retry] = q1, q2, q_status
+                c_other[retry], r_other[retry] = self.beacons[other], r[other][retry]
+            if self.project:  # no pair intersects, use the closest approach of circles 1 and 2
+                retry = status != STATUS_OK
+                p1[retry], p2[retry], status[retry] = circle_intersect_frame(*self.frames[0], r[0][retry],
+                                                                             r[1][retry], project=True)
+                c_other[retry], r_other[retry] = self.beacons[2], r[2][retry]
+            started = instrument.stop('trilaterate2d.batch.intersection', started)
+
+            closest = (np.abs(np.linalg.norm(p1 - c_other, axis=-1) - r_other) <
+                       np.abs(np.linalg.norm(p2 - c_other, axis=-1) - r_other))
+            position = select_points((p1, p2), ~closest)
+            instrument.stop('trilaterate2d.batch.disambiguation', started)
+        else:
+            *sol12, s12 = circle_intersect_frame(*self.frames[0], r[0], r[1], project=self.project)
+            *sol13, s13 = circle_intersect_frame(*self.frames[1], r[0], r[2], project=self.project)
+            *sol23, s23 = circle_intersect_frame(*self.frames[2], r[1], r[2], project=self.project)
+            status = np.where(s12 != STATUS_OK, s12, np.where(s13 != STATUS_OK, s13, s23))
+            started = instrument.stop('trilaterate2d.batch.intersection', started)
+
+            indices = nearest_points_batch(sol12, sol13, sol23)
+            started = instrument.stop('trilaterate2d.batch.disambiguation', started)
+            position = (select_points(sol12, indices[:, 0]) + select_points(sol13, indices[:, 1]) +
+                        select_points(sol23, indices[:, 2])) / 3
+            instrument.stop('trilaterate2d.batch.averaging', started)
+
+        position[(status != STATUS_OK) & (status != STATUS_PROJECTED)] = np.nan
+        instrument.count_status(self.beacons, status)
+        return position, status
 
 
 def trilaterate_lstsq(c, r):
@@ -118,16 +355,12 @@ def trilaterate_lstsq(c, r):
        this should be as close to r_i^2 as possible for i ranging over the number of beacons.
        NB: Note, that the A matrix which rows are [1 -2x_i -2y_i]  should be full rank and well conditioned!
        Note, there are other (and better) approaches, e.g. taking q = x^2+y^2 as an additional constraint.
+       See multilaterate.py for the general version with weights and many points at once, this function uses
+       its cached pseudo-inverse of A.
+       Returns the (2,1) array [[x], [y]]. NB: earlier versions returned [y, x] (the unknowns of A are q, x, y
+       and the last two were returned in reverse order), callers that swapped the result should stop doing so.
     """
-    nb = c.shape[1]
-    A = np.hstack((np.ones((nb, 1)), -2 * c.T))
-    # print(A)
-    b = np.zeros((nb, 1))
-    for i in range(nb):
-        b[i] = r[i] ** 2 - c[0, i] ** 2 - c[1, i] ** 2  # r_i^2 - x_i^2 - y_i^2
-    qyx, res, rank, sv = np.linalg.lstsq(A, b, rcond=1e-10)
-    # print(f'res = {res}, rank = {rank}')
-    return np.array([qyx[2], qyx[1]])
+    return multilaterate(c.T, np.ravel(r)).reshape(2, 1)
 
 
 def trilaterate2d_grid(points, a, b, c, a_d, b_d, c_d):
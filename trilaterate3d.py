@@ -9,7 +9,9 @@
    Rufus Fraanje, GNU-GPLv3, 2021/05/08
 """
 
+import math
 import numpy as np
+import instrument
 from geometry import *
 
 
@@ -27,15 +29,10 @@ def is_intersecting(c1, c2, r1, r2):
         return False
 
 
-def sphere_intersections(c1, c2, c3, r1, r2, r3):
-    """sphere_intersections(c1,c2,c3,r1,r2,r3) returns the two intersection points (that can be equal) of three spheres with center c1, c2, c3 and radii r1, r2 r3 respectively."""
-
-    if is_collinear(c1, c2, c3):
-        raise ValueError('c1, c2 and c3 should not be collinear, i.e. should not lay on a straight line.')
-    if not (is_intersecting(c1, c2, r1, r2) and is_intersecting(c1, c3, r1, r3) and is_intersecting(c2, c3, r2,
-                                                                                                    r3)):  # degenerate situation: no intersections
-        raise ValueError('There are no intersection points, two or three spheres do not intersect.')
-
+def sphere_frame(c1, c2, c3):
+    """sphere_frame(c1,c2,c3) returns the orthonormal basis v1, v2, v3 with origin c1 used in sphere_intersections,
+       together with the coordinates alpha2, alpha3 and beta3 of c2 = c1 + alpha2*v1 and c3 = c1 + alpha3*v1 + beta3*v2.
+       Only depends on the (non-collinear) centers, so it can be computed once for a fixed set of beacons."""
     d21 = c2 - c1  # direction from c1 to c2
     d31 = c3 - c1  # direction from c1 to c3
     v1 = normalized(d21)  # v1 points in direction of c1 to c2
@@ -50,11 +47,37 @@ def sphere_intersections(c1, c2, c3, r1, r2, r3):
     beta3 = np.dot(v2,
                    d31)  # -> beta3 = v2^T*(c3-c1), note beta3 is not 0, because c3-c1 is not zero and not perpendicular to v2
 
+    return v1, v2, v3, alpha2, alpha3, beta3
+
+
+def sphere_intersections(c1, c2, c3, r1, r2, r3, project=False):
+    """sphere_intersections(c1,c2,c3,r1,r2,r3) returns the two intersection points (that can be equal) of three spheres with center c1, c2, c3 and radii r1, r2 r3 respectively.
+       With project=True spheres that miss each other give twice the closest approach point, the point in the plane
+       of the centers where the radical planes of sphere 1,2 and 1,3 meet (gamma = 0), instead of a ValueError,
+       and a third value that is True when the point was projected."""
+
+    if is_collinear(c1, c2, c3):
+        raise CollinearError('c1, c2 and c3 should not be collinear, i.e. should not lay on a straight line.')
+    intersecting = is_intersecting(c1, c2, r1, r2) and is_intersecting(c1, c3, r1, r3) and is_intersecting(c2, c3, r2,
+                                                                                                           r3)
+    if not (intersecting or project):  # degenerate situation: no intersections
+        raise NoIntersectionError('There are no intersection points, two or three spheres do not intersect.')
+
+    v1, v2, v3, alpha2, alpha3, beta3 = sphere_frame(c1, c2, c3)
+
     alpha = (r1 ** 2 - r2 ** 2 + alpha2 ** 2) / (2 * alpha2)  # alpha2 cannot be zero, so no check is needed here
     beta = (r1 ** 2 - r3 ** 2 - 2 * alpha3 * alpha + alpha3 ** 2 + beta3 ** 2) / (
                 2 * beta3)  # beta3 cannot be zero, so no check is needed here
-    gamma = np.sqrt(
-        r1 ** 2 - alpha ** 2 - beta ** 2)  # if all three spheres intersect, alpha**2 + beta**2 <= r1**2, so no imaginary solutions
+    if project:
+        gamma2 = r1 ** 2 - alpha ** 2 - beta ** 2
+        projected = not intersecting or (gamma2 < 0 and not np.isclose(gamma2, 0))
+        gamma = 0.0 if projected else np.sqrt(max(gamma2, 0.0))
+        return c1 + alpha * v1 + beta * v2 + gamma * v3, c1 + alpha * v1 + beta * v2 - gamma * v3, projected
+    # pairwise intersecting spheres can still miss each other as a triple, then alpha**2 + beta**2 > r1**2
+    gamma2 = r1 ** 2 - alpha ** 2 - beta ** 2
+    if gamma2 < 0 and not np.isclose(gamma2, 0):  # as sphere_intersections_frame
+        raise NoIntersectionError('There are no intersection points, the three spheres do not intersect.')
+    gamma = np.sqrt(max(gamma2, 0.0))
 
     p1 = c1 + alpha * v1 + beta * v2 + gamma * v3
     p2 = c1 + alpha * v1 + beta * v2 - gamma * v3
@@ -62,13 +85,17 @@ def sphere_intersections(c1, c2, c3, r1, r2, r3):
     return p1, p2
 
 
+@instrument.counts_outcomes(4)
 def trilaterate(c1, c2, c3, c4, r1, r2, r3, r4):
     """trilaterate(c1,c2,c3,c4,r1,r2,r3,r4) returns the intersection point of the 4 intersecting spheres with
-       non-coplanar midpoints c1,c2,c3,c4 and radii r1,r2,r3,r4."""
+       non-coplanar midpoints c1,c2,c3,c4 and radii r1,r2,r3,r4.
+       Raises a TrilaterationError (a ValueError) of which the class gives the reason of the failure."""
 
+    started = instrument.start()
     # first check if c1,c2,c3 and c4 are coplanar
     if is_coplanar(c1, c2, c3, c4):
-        raise ValueError('c1, c2, c3 and c4 should not be coplanar, i.e. should not lay in same plane.')
+        raise CoplanarError('c1, c2, c3 and c4 should not be coplanar, i.e. should not lay in same plane.')
+    started = instrument.stop('trilaterate3d.validation', started)
 
     try:
         sol123 = sphere_intersections(c1, c2, c3, r1, r2, r3)
@@ -77,6 +104,154 @@ def trilaterate(c1, c2, c3, c4, r1, r2, r3, r4):
         sol234 = sphere_intersections(c2, c3, c4, r2, r3, r4)
     except ValueError as e:
         raise e
+    started = instrument.stop('trilaterate3d.intersection', started)
 
     indices = nearest_points(sol123, sol124, sol134, sol234)
-    return (sol123[indices[0]] + sol124[indices[1]] + sol134[indices[2]] + sol234[indices[3]]) / 4
+    started = instrument.stop('trilaterate3d.disambiguation', started)
+    point = (sol123[indices[0]] + sol124[indices[1]] + sol134[indices[2]] + sol234[indices[3]]) / 4
+    instrument.stop('trilaterate3d.averaging', started)
+    return point
+
+
+def sphere_intersections_batch(c1, c2, c3, r1, r2, r3, project=False):
+    """sphere_intersections_batch(c1,c2,c3,r1,r2,r3,project) is the array version of sphere_intersections for fixed
+       centers c1, c2, c3 and (N,) arrays with radii r1, r2, r3. Returns the intersection points p1, p2 as (N,3)
+       arrays and an (N,) array with status codes instead of raising ValueError, rows without solution are nan,
+       with project=True they get the closest approach point and STATUS_PROJECTED."""
+    c1, c2, c3 = (np.asarray(c, dtype=float) for c in (c1, c2, c3))
+    r1, r2, r3 = np.broadcast_arrays(*(np.asarray(r, dtype=float) for r in (r1, r2, r3)))
+    if is_collinear(c1, c2, c3):
+        return np.full(r1.shape + (3,), np.nan), np.full(r1.shape + (3,), np.nan), \
+               np.full(r1.shape, STATUS_COLLINEAR, dtype=np.int8)
+
+    v1, v2, v3, alpha2, alpha3, beta3 = sphere_frame(c1, c2, c3)
+    return sphere_intersections_frame(c1, v1, v2, v3, alpha2, alpha3, beta3, r1, r2, r3, project)
+
+
+def sphere_intersections_frame(c1, v1, v2, v3, alpha2, alpha3, beta3, r1, r2, r3, project=False):
+    """sphere_intersections_frame(c1,v1,v2,v3,alpha2,alpha3,beta3,r1,r2,r3,project) does the range dependent part
+       of sphere_intersections_batch, with the frame of the centers as returned by sphere_frame."""
+    # distances between the centers follow from the frame coordinates
+    d12 = np.abs(alpha2)
+    d13 = np.hypot(alpha3, beta3)
+    d23 = np.hypot(alpha3 - alpha2, beta3)
+    intersecting = ((np.abs(r1 - r2) <= d12) & (d12 <= r1 + r2) & (np.abs(r1 - r3) <= d13) & (d13 <= r1 + r3) &
+                    (np.abs(r2 - r3) <= d23) & (d23 <= r2 + r3))
+
+    alpha = (r1 ** 2 - r2 ** 2 + alpha2 ** 2) / (2 * alpha2)
+    beta = (r1 ** 2 - r3 ** 2 - 2 * alpha3 * alpha + alpha3 ** 2 + beta3 ** 2) / (2 * beta3)
+    gamma2 = r1 ** 2 - alpha ** 2 - beta ** 2
+    # pairwise intersecting spheres can still miss each other as a triple, rounding errors are clipped
+    intersecting &= (gamma2 >= 0) | np.isclose(gamma2, 0)
+    gamma = np.where(intersecting, np.sqrt(np.maximum(gamma2, 0)), 0.0)
+
+    status = np.where(intersecting, STATUS_OK, STATUS_PROJECTED if project else STATUS_NO_INTERSECTION)
+    status = status.astype(np.int8)
+    centre = c1 + alpha[..., None] * v1 + beta[..., None] * v2
+    p1 = centre + gamma[..., None] * v3
+    p2 = centre - gamma[..., None] * v3
+    if not project:
+        p1[~intersecting] = np.nan
+        p2[~intersecting] = np.nan
+
+    return p1, p2, status
+
+
+def trilaterate_batch(beacons, ranges, project=False):
+    """trilaterate_batch(beacons,ranges,project) is the array version of trilaterate. beacons is a (4,3) array with
+       the sphere centers c1..c4, ranges an (N,4) array in which every row holds the radii r1..r4 of one point.
+       Returns an (N,3) array with positions and an (N,) array with status codes, STATUS_OK marks the valid rows,
+       positions of the other rows are nan. With project=True sphere triples that miss each other use their
+       closest approach point and the row gets STATUS_PROJECTED."""
+    c1, c2, c3, c4 = np.asarray(beacons, dtype=float)
+    if is_coplanar(c1, c2, c3, c4):
+        n = len(np.atleast_2d(ranges))
+        status = np.full(n, STATUS_COPLANAR, dtype=np.int8)
+        instrument.count_status(beacons, status)
+        return np.full((n, 3), np.nan), status
+
+    return Trilaterator3D(beacons, project).solve_batch(ranges)
+
+
+class Trilaterator3D:
+    """Trilaterator3D(beacons,project) solves trilateration problems for a fixed set of four non-coplanar beacons,
+       beacons is a (4,3) array with the sphere centers c1..c4. The beacons are checked and the frames of the
+       four sphere triples (see sphere_frame) are computed once, so solve and solve_batch only do the arithmetic
+       that depends on the ranges. With project=True triples that miss each other use their closest approach
+       point (see sphere_intersections), solve_batch marks these rows with STATUS_PROJECTED.
+    """
+
+    # sphere triples in the order used by trilaterate
+    triples = ((0, 1, 2), (0, 1, 3), (0, 2, 3), (1, 2, 3))
+
+    def __init__(self, beacons, project=False):
+        started = instrument.start()
+        self.beacons = np.array(beacons, dtype=float)
+        self.project = project
+        if is_coplanar(*self.beacons):
+            raise CoplanarError('c1, c2, c3 and c4 should not be coplanar, i.e. should not lay in same plane.')
+
+        # per triple: origin c_i and the frame v1, v2, v3, alpha2, alpha3, beta3
+        self.frames = [(self.beacons[i],) + sphere_frame(*self.beacons[[i, j, k]]) for i, j, k in self.triples]
+        # the same as plain floats for the single point solver, with the distances between the centers
+        self.scalar_frames = []
+        for c, v1, v2, v3, alpha2, alpha3, beta3 in self.frames:
+            alpha2, alpha3, beta3 = float(alpha2), float(alpha3), float(beta3)
+            self.scalar_frames.append((tuple(map(float, c)), tuple(map(float, v1)), tuple(map(float, v2)),
+                                       tuple(map(float, v3)), alpha2, alpha3, beta3, abs(alpha2),
+                                       math.hypot(alpha3, beta3), math.hypot(alpha3 - alpha2, beta3)))
+        instrument.stop('trilaterate3d.batch.validation', started)
+
+    def intersect(self, k, r1, r2, r3, project=False):
+        """intersect(k,r1,r2,r3,project) returns the two intersection points of sphere triple k as tuples,
+           raises ValueError when the spheres do not intersect, or with project returns the closest approach
+           point twice and a third value that is True when the point was projected (as sphere_intersections)."""
+        c, v1, v2, v3, alpha2, alpha3, beta3, d12, d13, d23 = self.scalar_frames[k]
+        intersecting = abs(r1 - r2) <= d12 <= r1 + r2 and abs(r1 - r3) <= d13 <= r1 + r3 and \
+            abs(r2 - r3) <= d23 <= r2 + r3
+        if not (intersecting or project):
+            raise NoIntersectionError('There are no intersection points, two or three spheres do not intersect.')
+
+        alpha = (r1 ** 2 - r2 ** 2 + alpha2 ** 2) / (2 * alpha2)
+        beta = (r1 ** 2 - r3 ** 2 - 2 * alpha3 * alpha + alpha3 ** 2 + beta3 ** 2) / (2 * beta3)
+        gamma2 = r1 ** 2 - alpha ** 2 - beta ** 2
+        if gamma2 < 0 and abs(gamma2) > 1e-8:  # as np.isclose(gamma2, 0) in sphere_intersections_frame
+            if not project:
+                raise NoIntersectionError('There are no intersection points, two or three spheres do not intersect.')
+            intersecting = False
+        gamma = math.sqrt(max(gamma2, 0.0)) if intersecting else 0.0
+
+        centre = [c[n] + alpha * v1[n] + beta * v2[n] for n in range(3)]
+        p1, p2 = tuple(centre[n] + gamma * v3[n] for n in range(3)), tuple(centre[n] - gamma * v3[n] for n in range(3))
+        return (p1, p2, not intersecting) if project else (p1, p2)
+
+    def solve(self, r1, r2, r3, r4):
+        """solve(r1,r2,r3,r4) returns the point at distance r1..r4 of the beacons,
+           raises ValueError when no solution is found. With project it returns the point and a flag that is True
+           when the point is a projected estimate (STATUS_PROJECTED in solve_batch)."""
+        r = (float(r1), float(r2), float(r3), float(r4))
+        sols = [self.intersect(n, r[i], r[j], r[k], self.project) for n, (i, j, k) in enumerate(self.triples)]
+        point = np.array(nearest_points_mean(*[sol[:2] for sol in sols]))
+        return (point, any(sol[2] for sol in sols)) if self.project else point
+
+    def solve_batch(self, ranges):
+        """solve_batch(ranges) solves all rows r1..r4 of the (N,4) array ranges, returns an (N,3) array
+           with positions and an (N,) array with status codes, positions without solution are nan."""
+        r = np.atleast_2d(np.asarray(ranges, dtype=float)).T
+        started = instrument.start()
+
+        sols, status = [], np.zeros(r.shape[1], dtype=np.int8)
+        for frame, (i, j, k) in zip(self.frames, self.triples):
+            p1, p2, s = sphere_intersections_frame(*frame, r[i], r[j], r[k], project=self.project)
+            sols.append((p1, p2))
+            status = np.maximum(status, s)
+        started = instrument.stop('trilaterate3d.batch.intersection', started)
+
+        indices = nearest_points_batch(*sols)
+        started = instrument.stop('trilaterate3d.batch.disambiguation', started)
+        position = sum(select_points(sol, indices[:, n]) for n, sol in enumerate(sols)) / 4
+        instrument.stop('trilaterate3d.batch.averaging', started)
+        position[(status != STATUS_OK) & (status != STATUS_PROJECTED)] = np.nan
+        instrument.count_status(self.beacons, status)
+
+        return position, status
@@ -0,0 +1,41 @@
+"""
+   Chunked evaluation of error maps on large 2D and 3D grids
+
+   The grid of tools.create_grid is generated and solved in blocks of points (tools.iter_grid), the statistic of
+   every block is written in a preallocated or memory-mapped error volume. Peak memory depends on the chunk size,
+   not on the size of the grid.
+"""
+
+import numpy as np
+from experiment import Experiment
+from tools import grid_shape, iter_grid
+
+
+def error_volume(beacons, x_size, y_size, z_size=None, noise_level=0.01, trials=20, variant=3, seed=None,
+                 noise=None, spacing=1.0, chunk_size=65536, statistic='mean', out=None):
+    """error_volume(beacons,x_size,y_size,z_size,noise_level,trials,variant,seed,noise,spacing,chunk_size,statistic,out)
+       returns the error map of the grid of iter_grid(x_size, y_size, z_size, spacing=spacing), an array with
+       shape grid_shape(x_size, y_size, z_size). Every point is simulated as in experiment.Experiment, the map holds
+       the statistic ('mean', 'std', 'rms', 'p95' or 'found', see ExperimentResult.statistics) per point.
+       out is an existing array to fill, a file name for a new memory-mapped .npy file, or None for a new array.
+       The noise of block k is drawn from a generator spawned from the seed with key k."""
+    shape = grid_shape(x_size, y_size, z_size)
+    if out is None:
+        out = np.empty(shape)
+    elif isinstance(out, str):
+        out = np.lib.format.open_memmap(out, mode='w+', dtype=np.float64, shape=shape)
+    elif out.shape != shape:
+        raise ValueError('out should have shape {}.'.format(shape))
+
+    start = 0
+    for k, block in enumerate(iter_grid(x_size, y_size, z_size, chunk_size, spacing)):
+        rng = np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(k,)))
+        result = Experiment(beacons, block, [noise_level], trials, variant, noise=noise).run(rng=rng)
+        # index out itself, reshape(-1) would write into a copy when out is not C-contiguous
+        cells = np.unravel_index(np.arange(start, start + len(block)), shape)
+        out[cells] = result.statistics([statistic])[statistic][0]
+        start += len(block)
+
+    if isinstance(out, np.memmap):
+        out.flush()
+    return out